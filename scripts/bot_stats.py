@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+BookToNotes - Bot Statistics
+Tracks search latency and reliability per Zlib bot across runs. Used to rank
+bots and to decide when a slow search should be hedged to another bot.
+
+Usage:
+  python bot_stats.py status    # Show observed latency and reliability
+  python bot_stats.py reset     # Forget all observations
+"""
+
+import os
+import sys
+
+# Fix Windows encoding
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+    os.environ['PYTHONIOENCODING'] = 'utf-8'
+
+import argparse
+import json
+import math
+import threading
+
+from config import (
+    DATA_DIR, ZLIB_BOT_USERNAMES,
+    HEDGE_PERCENTILE, HEDGE_DEFAULT_DELAY, HEDGE_MIN_SAMPLES
+)
+from storage import write_json_atomic
+
+STATS_FILE = DATA_DIR / "bot_stats.json"
+MAX_SAMPLES = 50  # latency window per bot
+STATS_LOCK = threading.Lock()
+
+
+def log(msg: str, level: str = "INFO"):
+    icons = {"INFO": "[INFO]", "SUCCESS": "[OK]", "ERROR": "[ERROR]", "WARN": "[WARN]", "STEP": "[STEP]"}
+    print(f"{icons.get(level, '')} {msg}")
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    index = max(0, math.ceil(p * len(ordered)) - 1)
+    return ordered[index]
+
+
+def censored_percentile(latencies: list, censored: list, p: float) -> float:
+    """
+    Kaplan-Meier percentile. censored holds lower bounds (searches cancelled
+    before the bot answered): they count as "still waiting" up to their time
+    but never as answers, so they can only raise the estimate. Without any
+    censored values this equals percentile(). When too much is censored to
+    reach p, the largest observation is returned as a lower bound.
+    """
+    # At equal times an answer is counted before a cancellation
+    observations = sorted([(t, 0) for t in latencies] + [(t, 1) for t in censored])
+    at_risk = len(observations)
+    answered = 0.0
+    for t, is_censored in observations:
+        if not is_censored:
+            answered += (1 - answered) / at_risk
+            if answered >= p - 1e-9:
+                return t
+        at_risk -= 1
+    return observations[-1][0]
+
+
+class BotStats:
+    """Persistent per-bot latency samples and success counts"""
+
+    def __init__(self):
+        try:
+            self.data = json.loads(STATS_FILE.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            self.data = {}
+
+    def _entry(self, bot: str) -> dict:
+        entry = self.data.setdefault(bot, {'latencies': [], 'successes': 0, 'failures': 0})
+        entry.setdefault('censored', [])
+        return entry
+
+    def _samples(self, bot: str) -> tuple:
+        entry = self.data.get(bot, {})
+        return entry.get('latencies', []), entry.get('censored', [])
+
+    def save(self):
+        write_json_atomic(STATS_FILE, self.data, indent=2)
+
+    def record(self, bot: str, latency: float = None, success: bool = True):
+        """Record one search. latency is None when the bot never answered."""
+        with STATS_LOCK:
+            entry = self._entry(bot)
+            if success:
+                entry['successes'] += 1
+            else:
+                entry['failures'] += 1
+            if latency is not None:
+                entry['latencies'] = (entry['latencies'] + [round(latency, 3)])[-MAX_SAMPLES:]
+            self.save()
+
+    def record_censored(self, bot: str, elapsed: float):
+        """
+        Record a search cancelled because another bot answered first. elapsed
+        is only a lower bound on the latency, and losing the race is not a failure.
+        """
+        with STATS_LOCK:
+            entry = self._entry(bot)
+            entry['censored'] = (entry['censored'] + [round(elapsed, 3)])[-MAX_SAMPLES:]
+            self.save()
+
+    def reliability(self, bot: str) -> float:
+        """Success rate with a uniform prior, so unseen bots start at 0.5"""
+        entry = self.data.get(bot, {})
+        successes = entry.get('successes', 0)
+        failures = entry.get('failures', 0)
+        return (successes + 1) / (successes + failures + 2)
+
+    def median_latency(self, bot: str) -> float:
+        latencies, censored = self._samples(bot)
+        if len(latencies) + len(censored) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return censored_percentile(latencies, censored, 0.5)
+
+    def hedge_delay(self, bot: str) -> float:
+        """Seconds to wait on a bot before sending the same search to the next one"""
+        latencies, censored = self._samples(bot)
+        if len(latencies) + len(censored) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return censored_percentile(latencies, censored, HEDGE_PERCENTILE)
+
+    def score(self, bot: str) -> float:
+        return self.reliability(bot) / max(self.median_latency(bot), 0.1)
+
+    def rank(self, bots: list) -> list:
+        """Order bots best-first; ties keep the configured order"""
+        return sorted(bots, key=self.score, reverse=True)
+
+
+def show_status():
+    stats = BotStats()
+
+    print("\n" + "=" * 70)
+    print("Bot Statistics:")
+    print("=" * 70)
+
+    for bot in stats.rank(ZLIB_BOT_USERNAMES):
+        latencies, censored = stats._samples(bot)
+        print(f"\n  @{bot}")
+        print(f"      reliability {stats.reliability(bot):.0%} | "
+              f"median {stats.median_latency(bot):.1f}s | "
+              f"hedge after {stats.hedge_delay(bot):.1f}s | "
+              f"{len(latencies)} samples, {len(censored)} cancelled")
+
+    print("\n" + "=" * 70)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Zlib bot latency and reliability statistics')
+    parser.add_argument('action', choices=['status', 'reset'],
+                       help='Action to perform')
+    args = parser.parse_args()
+
+    if args.action == 'status':
+        show_status()
+    elif args.action == 'reset':
+        if STATS_FILE.exists():
+            STATS_FILE.unlink()
+        log("Bot statistics cleared", "SUCCESS")
+
+
+if __name__ == "__main__":
+    main()
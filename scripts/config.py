@@ -16,10 +16,17 @@ TELEGRAM_API_ID = 2040
 TELEGRAM_API_HASH = "b18441a1ff607e10a989891a5462e627"
 
 # =============================================================================
-# Zlib Bot Username (without @)
-# This is a public Telegram bot for searching ebooks
+# Zlib Bot Usernames (without @)
+# Public Telegram bots for searching ebooks, in order of preference.
+# With more than one bot, a search that is slower than usual is hedged:
+# the same query goes to the next bot and the first usable answer wins.
 # =============================================================================
-ZLIB_BOT_USERNAME = "zlaboratory_bot"  # Change to your preferred bot
+ZLIB_BOT_USERNAMES = ["zlaboratory_bot"]  # Add compatible bots to enable hedging
+ZLIB_BOT_USERNAME = ZLIB_BOT_USERNAMES[0]
+
+HEDGE_PERCENTILE = 0.9  # hedge once the primary bot exceeds this latency percentile
+HEDGE_DEFAULT_DELAY = 8  # seconds, used until HEDGE_MIN_SAMPLES searches are recorded
+HEDGE_MIN_SAMPLES = 5
 
 # =============================================================================
 # Path Configuration
@@ -29,8 +36,11 @@ ZLIB_BOT_USERNAME = "zlaboratory_bot"  # Change to your preferred bot
 # Base directory (where this skill is installed)
 SKILL_DIR = Path(__file__).parent.parent
 
+# Local state (sessions, indexes, journals)
+DATA_DIR = SKILL_DIR / "data"
+
 # Session storage (for Telegram auth)
-SESSION_DIR = SKILL_DIR / "data" / "session"
+SESSION_DIR = DATA_DIR / "session"
 
 # Download directory for ebooks
 DOWNLOAD_DIR = SKILL_DIR / "downloads"
@@ -54,6 +64,11 @@ if os.name == 'nt':  # Windows
 else:  # macOS/Linux
     CALIBRE_PATH = "ebook-convert"
 
+# Chapter-parallel EPUB conversion (requires: pip install pypdf)
+# EPUBs at least this large are split into chapter groups converted concurrently
+PARALLEL_CONVERT_MIN_SIZE = 5 * 1024 * 1024  # bytes
+PARALLEL_CONVERT_WORKERS = None  # None = number of CPU cores
+
 # NotebookLM Skill directory (required dependency)
 # Install from: https://github.com/anthropics/claude-code-skills
 NOTEBOOKLM_SKILL_DIR = Path.home() / ".claude" / "skills" / "notebooklm"
@@ -61,9 +76,60 @@ NOTEBOOKLM_SKILL_DIR = Path.home() / ".claude" / "skills" / "notebooklm"
 # =============================================================================
 # Download Settings
 # =============================================================================
-DOWNLOAD_TIMEOUT = 120  # seconds
+DOWNLOAD_REPLY_TIMEOUT = 120  # seconds to wait for the bot to send the file
+DOWNLOAD_STALL_TIMEOUT = 30  # seconds without progress before aborting (at least one part at min throughput)
+DOWNLOAD_MIN_THROUGHPUT = 8 * 1024  # bytes/sec; slower transfers are aborted...
+DOWNLOAD_THROUGHPUT_WINDOW = 60  # ...when measured over this many seconds
+DOWNLOAD_PROGRESS_INTERVAL = 5  # seconds between progress reports
+DOWNLOAD_MAX_CANDIDATES = 3  # search results to try when downloads fail validation
 SEARCH_TIMEOUT = 30  # seconds
 MAX_SEARCH_RESULTS = 5  # max results to display
 
+# Retries for transient stage failures (download, upload)
+STAGE_MAX_ATTEMPTS = 3
+STAGE_BACKOFF_BASE = 5  # seconds, doubled after every failed attempt
+STAGE_BACKOFF_MAX = 60  # seconds
+
 # Supported ebook formats (in order of preference)
 PREFERRED_FORMATS = ['epub', 'pdf', 'mobi', 'azw3']
+
+# =============================================================================
+# Duplicate Detection
+# Books are fingerprinted before conversion; a near-duplicate of a book that
+# was already prepared can reuse its notebook instead of converting/uploading.
+# =============================================================================
+FINGERPRINT_REUSE = "ask"  # "ask" (prompt when interactive), "always" or "never"
+FINGERPRINT_REUSE_UNATTENDED = "never"  # used by service.py and work_queue.py workers
+FINGERPRINT_THRESHOLD = 0.5  # estimated text similarity (Jaccard of 5-word shingles)
+FINGERPRINT_META_THRESHOLD = 0.95  # title similarity (same author required) when no text is available
+FINGERPRINT_MAX_CHARS = 2000000  # text sampled per book
+
+# =============================================================================
+# Storage Budgets
+# Downloads and converted PDFs are evicted least-recently-used first once a
+# directory grows past its budget. None means unlimited.
+# =============================================================================
+DOWNLOAD_DIR_BUDGET = 2 * 1024 ** 3  # bytes
+TEMP_DIR_BUDGET = 1 * 1024 ** 3  # bytes
+OUTPUT_DIR_BUDGET = None  # generated notes are kept by default
+STORAGE_GC_INLINE = True  # run gc at the end of every prepare.py run
+STORAGE_MIN_AGE = 300  # seconds; never evict anything modified more recently
+STORAGE_PIN_TTL = 6 * 3600  # seconds; pins older than this are considered stale
+
+# =============================================================================
+# Job Service (python service.py)
+# =============================================================================
+SERVICE_HOST = "127.0.0.1"  # localhost only
+SERVICE_PORT = 8765
+SERVICE_WORKERS = 2  # concurrent convert/upload jobs
+
+# =============================================================================
+# Distributed Work Queue (python work_queue.py)
+# Point WORK_QUEUE_DB at storage shared by all worker hosts. Worker clocks
+# must be roughly in sync, since lease expiry uses wall-clock time.
+# =============================================================================
+WORK_QUEUE_DB = DATA_DIR / "work_queue.db"
+WORK_LEASE_SECONDS = 600  # a job is re-queued if its worker stops heartbeating this long
+WORK_HEARTBEAT_INTERVAL = 60  # seconds between lease renewals
+WORK_MAX_ATTEMPTS = 3  # claims per job before it is marked failed
+WORK_POLL_INTERVAL = 10  # seconds between checks of an empty queue
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+BookToNotes - Edition & Format Fingerprinting
+Detects near-duplicate books (same text as EPUB and PDF, or another edition
+under a different filename) with a MinHash signature of the extracted text,
+falling back to title/author metadata when no text can be extracted.
+
+PDF text extraction requires pypdf: pip install pypdf
+
+Usage:
+  python fingerprint.py scan                  # Fingerprint every file in downloads/
+  python fingerprint.py check "book.epub"     # Show near-duplicates of a file
+  python fingerprint.py list                  # Show fingerprinted books
+"""
+
+import os
+import sys
+
+# Fix Windows encoding
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+    os.environ['PYTHONIOENCODING'] = 'utf-8'
+
+import argparse
+import hashlib
+import heapq
+import html
+import json
+import re
+import struct
+import threading
+import time
+import xml.etree.ElementTree as ET
+import zipfile
+from pathlib import Path
+
+from config import (
+    DATA_DIR, DOWNLOAD_DIR,
+    FINGERPRINT_THRESHOLD, FINGERPRINT_META_THRESHOLD, FINGERPRINT_MAX_CHARS
+)
+from journal import file_sha256
+from parallel_convert import find_opf
+from storage import write_json_atomic
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+INDEX_FILE = DATA_DIR / "fingerprints.json"
+INDEX_LOCK = threading.Lock()
+SIGNATURE_SIZE = 256  # bottom-k MinHash: keep the k smallest shingle hashes
+SHINGLE_SIZE = 5  # tokens per shingle
+MIN_TEXT_SHINGLES = 200  # below this the text signature is not trusted
+
+DC = "{http://purl.org/dc/elements/1.1/}"
+TOKEN_RE = re.compile(r'[\u4e00-\u9fff]|[^\W\u4e00-\u9fff]+')
+
+
+def log(msg: str, level: str = "INFO"):
+    icons = {"INFO": "[INFO]", "SUCCESS": "[OK]", "ERROR": "[ERROR]", "WARN": "[WARN]", "STEP": "[STEP]"}
+    print(f"{icons.get(level, '')} {msg}")
+
+
+# =============================================================================
+# Text and metadata extraction
+# =============================================================================
+
+def strip_markup(markup: str) -> str:
+    markup = re.sub(r'<(script|style)\b.*?</\1>', ' ', markup, flags=re.S | re.I)
+    return html.unescape(re.sub(r'<[^>]+>', ' ', markup))
+
+
+def extract_epub(path: Path) -> tuple:
+    title, author, parts, length = '', '', [], 0
+    with zipfile.ZipFile(path) as zf:
+        try:
+            opf = ET.fromstring(zf.read(find_opf(zf)))
+            title = (opf.findtext(f".//{DC}title") or '').strip()
+            author = ' & '.join(c.text.strip() for c in opf.iter(f"{DC}creator") if c.text)
+        except (KeyError, ValueError, ET.ParseError):
+            pass
+
+        for name in zf.namelist():
+            if length >= FINGERPRINT_MAX_CHARS:
+                break
+            if name.lower().endswith(('.xhtml', '.html', '.htm')):
+                text = strip_markup(zf.read(name).decode('utf-8', errors='ignore'))
+                parts.append(text)
+                length += len(text)
+
+    return title, author, ' '.join(parts)[:FINGERPRINT_MAX_CHARS]
+
+
+def extract_pdf(path: Path) -> tuple:
+    if PdfReader is None:
+        return '', '', ''
+
+    reader = PdfReader(str(path))
+    meta = reader.metadata or {}
+    title = (meta.get('/Title') or '').strip()
+    author = (meta.get('/Author') or '').strip()
+
+    parts, length = [], 0
+    for page in reader.pages:
+        if length >= FINGERPRINT_MAX_CHARS:
+            break
+        text = page.extract_text() or ''
+        parts.append(text)
+        length += len(text)
+
+    return title, author, ' '.join(parts)[:FINGERPRINT_MAX_CHARS]
+
+
+def extract_docx(path: Path) -> tuple:
+    with zipfile.ZipFile(path) as zf:
+        text = strip_markup(zf.read('word/document.xml').decode('utf-8', errors='ignore'))
+        title, author = '', ''
+        if 'docProps/core.xml' in zf.namelist():
+            core = ET.fromstring(zf.read('docProps/core.xml'))
+            title = (core.findtext(f"{DC}title") or '').strip()
+            author = (core.findtext(f"{DC}creator") or '').strip()
+    return title, author, text[:FINGERPRINT_MAX_CHARS]
+
+
+def extract_mobi(path: Path) -> tuple:
+    """
+    Title and author from the EXTH header of a MOBI/AZW/AZW3 file. The text
+    is compressed, so these formats are matched on metadata only.
+    """
+    with open(path, 'rb') as f:
+        data = f.read(256 * 1024)
+
+    record_count = struct.unpack_from('>H', data, 76)[0]
+    if not record_count:
+        return '', '', ''
+    rec0 = struct.unpack_from('>I', data, 78)[0]
+    if data[rec0 + 16:rec0 + 20] != b'MOBI':
+        return '', '', ''
+
+    header_length, encoding = struct.unpack_from('>II', data, rec0 + 20)
+    codec = 'cp1252' if encoding == 1252 else 'utf-8'
+    name_offset, name_length = struct.unpack_from('>II', data, rec0 + 84)
+    title = data[rec0 + name_offset:rec0 + name_offset + name_length].decode(codec, errors='ignore')
+
+    authors = []
+    exth_flags = struct.unpack_from('>I', data, rec0 + 128)[0]
+    exth = rec0 + 16 + header_length
+    if exth_flags & 0x40 and data[exth:exth + 4] == b'EXTH':
+        count = struct.unpack_from('>I', data, exth + 8)[0]
+        pos = exth + 12
+        for _ in range(count):
+            kind, length = struct.unpack_from('>II', data, pos)
+            value = data[pos + 8:pos + length].decode(codec, errors='ignore').strip()
+            if kind == 100:  # creator, one record per author
+                authors.append(value)
+            elif kind == 503 and value:  # updated title
+                title = value
+            pos += length
+
+    return title.strip(), ' & '.join(authors), ''
+
+
+def extract_txt(path: Path) -> tuple:
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        return '', '', f.read(FINGERPRINT_MAX_CHARS)
+
+
+EXTRACTORS = {
+    '.epub': extract_epub,
+    '.pdf': extract_pdf,
+    '.docx': extract_docx,
+    '.mobi': extract_mobi,
+    '.azw': extract_mobi,
+    '.azw3': extract_mobi,
+    '.txt': extract_txt,
+}
+
+
+def extract(path: Path) -> tuple:
+    """Return (title, author, text). Unsupported or broken files yield empty text."""
+    extractor = EXTRACTORS.get(path.suffix.lower())
+    title, author, text = '', '', ''
+    if extractor:
+        try:
+            title, author, text = extractor(path)
+        except Exception as e:
+            log(f"Cannot extract text from {path.name}: {e}", "WARN")
+    return title or path.stem, author, text
+
+
+# =============================================================================
+# Signatures
+# =============================================================================
+
+def tokenize(text: str) -> list:
+    """Lowercased words; CJK characters count as one token each"""
+    return TOKEN_RE.findall(text.lower())
+
+
+def shingle_hashes(tokens: list) -> set:
+    hashes = set()
+    for i in range(len(tokens) - SHINGLE_SIZE + 1):
+        shingle = ' '.join(tokens[i:i + SHINGLE_SIZE]).encode('utf-8')
+        hashes.add(int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), 'big'))
+    return hashes
+
+
+def minhash(hashes: set) -> list:
+    """Bottom-k MinHash signature (sorted)"""
+    return heapq.nsmallest(SIGNATURE_SIZE, hashes)
+
+
+def estimate_similarity(sig_a: list, sig_b: list) -> float:
+    """Jaccard similarity estimate from two bottom-k signatures"""
+    if not sig_a or not sig_b:
+        return 0.0
+    set_a, set_b = set(sig_a), set(sig_b)
+    union_bottom = heapq.nsmallest(SIGNATURE_SIZE, set_a | set_b)
+    shared = sum(1 for h in union_bottom if h in set_a and h in set_b)
+    return shared / len(union_bottom)
+
+
+def normalize_meta(title: str, author: str) -> str:
+    # Drop edition noise such as "(2nd Edition)" or "[Z-Library]"
+    title = re.sub(r'[\(\[【（].*?[\)\]】）]', ' ', title)
+    return ' '.join(tokenize(f"{title} {author}"))
+
+
+def meta_similarity(a: str, b: str) -> float:
+    """Jaccard similarity of character trigrams"""
+    grams_a = {a[i:i + 3] for i in range(len(a) - 2)}
+    grams_b = {b[i:i + 3] for i in range(len(b) - 2)}
+    if not grams_a or not grams_b:
+        return 0.0
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+def compute(path: Path) -> dict:
+    """Fingerprint one file"""
+    title, author, text = extract(path)
+    hashes = shingle_hashes(tokenize(text))
+    return {
+        'path': str(path),
+        'sha256': file_sha256(path),
+        'title': title,
+        'author': author,
+        'meta': normalize_meta(title, author),
+        'signature': minhash(hashes) if len(hashes) >= MIN_TEXT_SHINGLES else [],
+        'created_at': time.time(),
+    }
+
+
+def same_work(fp_a: dict, fp_b: dict) -> bool:
+    """
+    Metadata-only guard: authors must be known and equal, and titles must
+    carry the same numbers (volume, part, year), so "Vol 1" never matches "Vol 2".
+    Files without an author (plain text) therefore only match on text.
+    """
+    author_a = tokenize(fp_a.get('author') or '')
+    author_b = tokenize(fp_b.get('author') or '')
+    if not author_a or sorted(author_a) != sorted(author_b):
+        return False
+    return re.findall(r'\d+', fp_a.get('title') or '') == re.findall(r'\d+', fp_b.get('title') or '')
+
+
+def similarity(fp_a: dict, fp_b: dict) -> tuple:
+    """Return (score, basis) where basis is 'exact', 'text' or 'metadata'"""
+    if fp_a['sha256'] == fp_b['sha256']:
+        return 1.0, 'exact'
+    if fp_a['signature'] and fp_b['signature']:
+        return estimate_similarity(fp_a['signature'], fp_b['signature']), 'text'
+    if not same_work(fp_a, fp_b):
+        return 0.0, 'metadata'
+    return meta_similarity(fp_a['meta'], fp_b['meta']), 'metadata'
+
+
+def is_duplicate(score: float, basis: str) -> bool:
+    if basis == 'metadata':
+        return score >= FINGERPRINT_META_THRESHOLD
+    return score >= FINGERPRINT_THRESHOLD
+
+
+# =============================================================================
+# Index
+# =============================================================================
+
+class FingerprintIndex:
+    """Persistent fingerprints keyed by file hash, with the notebook they became"""
+
+    def __init__(self):
+        self.entries = self._load()
+
+    @staticmethod
+    def _load() -> dict:
+        try:
+            return json.loads(INDEX_FILE.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        write_json_atomic(INDEX_FILE, self.entries)
+
+    def add(self, fp: dict, **prepared):
+        """Store a fingerprint; prepared carries book_name/pdf_file/notebook_id/notebook_url"""
+        with INDEX_LOCK:
+            # Merge into the latest index so entries added by other jobs are kept
+            self.entries = self._load()
+            entry = dict(self.entries.get(fp['sha256'], {}), **fp)
+            entry.update({k: v for k, v in prepared.items() if v is not None})
+            self.entries[fp['sha256']] = entry
+            self.save()
+
+    def find_duplicates(self, fp: dict, prepared_only: bool = False) -> list:
+        """Entries similar to fp, best first, as (score, basis, entry)"""
+        matches = []
+        for entry in self.entries.values():
+            if entry['path'] == fp['path'] and entry['sha256'] == fp['sha256']:
+                continue
+            if prepared_only and not entry.get('notebook_id'):
+                continue
+            score, basis = similarity(fp, entry)
+            if is_duplicate(score, basis):
+                matches.append((score, basis, entry))
+        matches.sort(key=lambda m: m[0], reverse=True)
+        return matches
+
+
+def scan_downloads() -> int:
+    index = FingerprintIndex()
+    known = {e['path']: e['sha256'] for e in index.entries.values()}
+    count = 0
+    if not DOWNLOAD_DIR.exists():
+        return count
+
+    for path in sorted(DOWNLOAD_DIR.iterdir()):
+        if not path.is_file() or path.name.endswith('.part'):
+            continue
+        if str(path) in known and known[str(path)] == file_sha256(path):
+            continue
+        log(f"Fingerprinting: {path.name}", "INFO")
+        index.add(compute(path))
+        count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Detect near-duplicate books')
+    parser.add_argument('action', choices=['scan', 'check', 'list'],
+                       help='Action to perform')
+    parser.add_argument('file', nargs='?', help='Ebook file (for check)')
+    args = parser.parse_args()
+
+    if args.action == 'scan':
+        count = scan_downloads()
+        log(f"Fingerprinted {count} new files", "SUCCESS")
+
+    elif args.action == 'check':
+        if not args.file:
+            parser.error("check needs a file")
+        fp = compute(Path(args.file))
+        matches = FingerprintIndex().find_duplicates(fp)
+        if not matches:
+            log("No near-duplicates found", "INFO")
+        for score, basis, entry in matches:
+            notebook = entry.get('notebook_url') or entry.get('notebook_id') or 'not prepared'
+            print(f"  {score:.0%} ({basis})  {entry['path']}  ->  {notebook}")
+
+    elif args.action == 'list':
+        for entry in FingerprintIndex().entries.values():
+            mark = 'prepared' if entry.get('notebook_id') else 'indexed'
+            print(f"  [{mark}] {entry['title']} - {entry['author'] or '?'}  ({entry['path']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+BookToNotes - Download Integrity Checks
+Catches broken downloads (zero-byte files, HTML error pages, truncated zips,
+PDFs without a trailer) before they reach Calibre or NotebookLM.
+
+Usage:
+  python integrity.py "book.epub" ["other.pdf" ...]
+"""
+
+import os
+import sys
+
+# Fix Windows encoding
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+    os.environ['PYTHONIOENCODING'] = 'utf-8'
+
+import argparse
+import hashlib
+import zipfile
+from pathlib import Path
+
+HEAD_SIZE = 1024  # bytes needed for every magic check (%PDF- may follow leading junk)
+PDF_TRAILER_WINDOW = 8192  # %%EOF must appear within this many trailing bytes
+
+ZIP_MAGIC = b'PK\x03\x04'
+MOBI_MAGICS = (b'BOOKMOBI', b'TEXtREAd')
+HTML_MARKERS = (b'<!doctype html', b'<html', b'<head')
+
+# Zip entries that must exist for each zip-based format
+ZIP_REQUIRED = {
+    '.epub': ['META-INF/container.xml'],
+    '.docx': ['word/document.xml'],
+}
+
+
+class IntegrityError(Exception):
+    """Raised when a file (or a stream being downloaded) is not a valid ebook"""
+
+
+def log(msg: str, level: str = "INFO"):
+    icons = {"INFO": "[INFO]", "SUCCESS": "[OK]", "ERROR": "[ERROR]", "WARN": "[WARN]", "STEP": "[STEP]"}
+    print(f"{icons.get(level, '')} {msg}")
+
+
+def check_head(head: bytes, suffix: str):
+    """Validate the first bytes of a file against its extension"""
+    suffix = suffix.lower()
+    stripped = head.lstrip().lower()
+
+    # XML formats such as FB2 start with <?xml too; only XHTML pages are rejected
+    is_xhtml = stripped.startswith(b'<?xml') and b'<html' in stripped
+    if suffix != '.txt' and (stripped.startswith(HTML_MARKERS) or is_xhtml):
+        raise IntegrityError("file is an HTML page, not an ebook")
+
+    if suffix == '.pdf' and b'%PDF-' not in head[:HEAD_SIZE]:
+        raise IntegrityError("missing %PDF- header")
+    if suffix in ('.epub', '.docx') and not head.startswith(ZIP_MAGIC):
+        raise IntegrityError("missing zip header")
+    if suffix in ('.mobi', '.azw', '.azw3') and len(head) >= 68 and head[60:68] not in MOBI_MAGICS:
+        raise IntegrityError("missing MOBI/PalmDB header")
+
+
+def check_pdf_trailer(path: Path):
+    size = path.stat().st_size
+    with open(path, 'rb') as f:
+        f.seek(max(0, size - PDF_TRAILER_WINDOW))
+        if b'%%EOF' not in f.read():
+            raise IntegrityError("PDF trailer (%%EOF) missing, file is truncated")
+
+
+def check_zip(path: Path, suffix: str):
+    try:
+        with zipfile.ZipFile(path) as zf:
+            names = set(zf.namelist())
+    except zipfile.BadZipFile as e:
+        raise IntegrityError(f"zip central directory unreadable ({e}), file is truncated")
+
+    for required in ZIP_REQUIRED.get(suffix, []):
+        if required not in names:
+            raise IntegrityError(f"missing {required}")
+
+
+def validate_file(path: Path, expected_size: int = None, suffix: str = None):
+    """
+    Raise IntegrityError if the file is not a plausible ebook of its extension.
+    suffix overrides the extension (e.g. for .part files still being renamed).
+    """
+    size = path.stat().st_size
+    if size == 0:
+        raise IntegrityError("file is empty")
+    if expected_size and size != expected_size:
+        raise IntegrityError(f"size {size} does not match expected {expected_size}")
+
+    suffix = (suffix or path.suffix).lower()
+    with open(path, 'rb') as f:
+        check_head(f.read(HEAD_SIZE), suffix)
+
+    if suffix == '.pdf':
+        check_pdf_trailer(path)
+    elif suffix in ('.epub', '.docx'):
+        check_zip(path, suffix)
+
+
+class ValidatingWriter:
+    """
+    File-like sink for Telethon downloads. Hashes data as it arrives and
+    rejects the stream as soon as its first bytes do not match the format.
+    """
+
+    def __init__(self, path: Path, suffix: str):
+        self.file = open(path, 'wb')
+        self.suffix = suffix
+        self.sha256 = hashlib.sha256()
+        self.head = b''
+        self.head_checked = False
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        if not self.head_checked:
+            self.head += bytes(data[:HEAD_SIZE - len(self.head)])
+            if len(self.head) >= HEAD_SIZE:
+                check_head(self.head, self.suffix)
+                self.head_checked = True
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def hexdigest(self) -> str:
+        return self.sha256.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check downloaded ebooks for corruption')
+    parser.add_argument('files', nargs='+', help='Files to check')
+    args = parser.parse_args()
+
+    failed = 0
+    for name in args.files:
+        path = Path(name)
+        try:
+            validate_file(path)
+            log(f"{path}: OK", "SUCCESS")
+        except (IntegrityError, OSError) as e:
+            log(f"{path}: {e}", "ERROR")
+            failed += 1
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+BookToNotes - Stage Journal
+Records completed preparation stages (download, convert, upload) per book,
+with artifact paths and SHA-256 hashes, so a rerun resumes at the first
+unfinished stage instead of starting over.
+
+Usage:
+  python journal.py list              # Show journaled books
+  python journal.py show "Book Title" # Show stages for a query
+  python journal.py clear             # Delete all journals
+"""
+
+import os
+import sys
+
+# Fix Windows encoding
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+    os.environ['PYTHONIOENCODING'] = 'utf-8'
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+
+from config import DATA_DIR, STAGE_MAX_ATTEMPTS, STAGE_BACKOFF_BASE, STAGE_BACKOFF_MAX
+from storage import write_json_atomic
+
+JOURNAL_DIR = DATA_DIR / "journal"
+STAGES = ['download', 'convert', 'upload']
+JOURNAL_LOCK = threading.Lock()
+
+
+def log(msg: str, level: str = "INFO"):
+    icons = {"INFO": "[INFO]", "SUCCESS": "[OK]", "ERROR": "[ERROR]", "WARN": "[WARN]", "STEP": "[STEP]"}
+    print(f"{icons.get(level, '')} {msg}")
+
+
+def file_sha256(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def book_key(query: str = None, file_path: str = None) -> str:
+    """Stable identity of a preparation request"""
+    if file_path:
+        return f"file:{Path(file_path).resolve()}"
+    return f"query:{' '.join(query.lower().split())}"
+
+
+class StageJournal:
+    """Per-book record of completed stages"""
+
+    def __init__(self, key: str):
+        self.key = key
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        self.path = JOURNAL_DIR / f"{digest}.json"
+        self.data = self._load()
+
+    def _load(self) -> dict:
+        try:
+            data = json.loads(self.path.read_text(encoding='utf-8'))
+            if data.get('key') == self.key:
+                return data
+        except (OSError, ValueError):
+            pass
+        return {'key': self.key, 'stages': {}}
+
+    def _save(self):
+        self.data['updated_at'] = time.time()
+        with JOURNAL_LOCK:
+            write_json_atomic(self.path, self.data, indent=2)
+
+    def record(self, stage: str, artifact: Path = None, **info):
+        """Mark a stage complete. The artifact (if any) is hashed for later verification."""
+        entry = dict(info, completed_at=time.time())
+        if artifact:
+            entry['path'] = str(artifact)
+            entry['sha256'] = file_sha256(artifact)
+            entry['size'] = artifact.stat().st_size
+        self.data['stages'][stage] = entry
+        # Later stages were derived from the previous artifact and are now stale
+        for later in STAGES[STAGES.index(stage) + 1:]:
+            self.data['stages'].pop(later, None)
+        self._save()
+
+    def completed(self, stage: str):
+        """Return the stage entry if it finished and its artifact is still intact, else None"""
+        entry = self.data['stages'].get(stage)
+        if not entry:
+            return None
+
+        if 'path' in entry:
+            path = Path(entry['path'])
+            try:
+                if path.stat().st_size != entry['size'] or file_sha256(path) != entry['sha256']:
+                    log(f"Journal: {stage} artifact changed, redoing stage", "WARN")
+                    return None
+            except OSError:
+                log(f"Journal: {stage} artifact missing, redoing stage", "WARN")
+                return None
+
+        return entry
+
+    def reset(self):
+        self.data = {'key': self.key, 'stages': {}}
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class StageAborted(Exception):
+    """Raised by a stage function when the job must stop (e.g. its lease was lost)"""
+
+
+class StageFailed(Exception):
+    """A preparation stage gave up. str() is "<stage>: <reason>", suitable for job records."""
+
+    def __init__(self, stage: str, reason: str):
+        super().__init__(f"{stage}: {reason}")
+        self.stage = stage
+        self.reason = reason
+
+
+def run_with_retries(stage: str, func, *args, attempts: int = STAGE_MAX_ATTEMPTS, fatal: tuple = (), **kwargs):
+    """
+    Call a stage function, retrying with exponential backoff, and return its result.
+    Stage functions signal failure by returning a falsy value (or a tuple whose
+    first item is falsy) or by raising. StageAborted, and exceptions of a type
+    in fatal, end the stage at once, for failures a retry cannot fix.
+    Raises StageFailed with the last error once the stage gives up.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            result = func(*args, **kwargs)
+            reason = "no result"
+        except (StageAborted,) + tuple(fatal) as e:
+            log(f"{stage} failed: {e}", "ERROR")
+            raise StageFailed(stage, str(e))
+        except Exception as e:
+            log(f"{stage} raised: {e}", "ERROR")
+            result, reason = None, str(e) or type(e).__name__
+
+        failed = not result or (isinstance(result, tuple) and not result[0])
+        if not failed:
+            return result
+
+        if attempt < attempts:
+            delay = min(STAGE_BACKOFF_BASE * 2 ** (attempt - 1), STAGE_BACKOFF_MAX)
+            log(f"{stage} failed (attempt {attempt}/{attempts}), retrying in {delay:.0f}s...", "WARN")
+            time.sleep(delay)
+
+    raise StageFailed(stage, reason)
+
+
+def list_journals():
+    if not JOURNAL_DIR.exists():
+        print("\nNo journals found.")
+        return
+
+    print("\n" + "=" * 70)
+    print("Stage Journals:")
+    print("=" * 70)
+    for path in sorted(JOURNAL_DIR.glob("*.json")):
+        try:
+            data = json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            continue
+        done = [s for s in STAGES if s in data.get('stages', {})]
+        print(f"\n  {data.get('key')}")
+        print(f"      completed: {', '.join(done) or '-'}")
+    print("\n" + "=" * 70)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BookToNotes stage journal')
+    parser.add_argument('action', choices=['list', 'show', 'clear'],
+                       help='Action to perform')
+    parser.add_argument('query', nargs='?', help='Book title (for show)')
+    parser.add_argument('--file', '-f', help='Local ebook file path (for show)')
+    args = parser.parse_args()
+
+    if args.action == 'list':
+        list_journals()
+    elif args.action == 'show':
+        if not args.query and not args.file:
+            parser.error("show needs a book title or --file")
+        journal = StageJournal(book_key(args.query, args.file))
+        print(json.dumps(journal.data, ensure_ascii=False, indent=2))
+    elif args.action == 'clear':
+        count = 0
+        if JOURNAL_DIR.exists():
+            for path in JOURNAL_DIR.glob("*.json"):
+                path.unlink()
+                count += 1
+        log(f"Deleted {count} journals", "SUCCESS")
+
+
+if __name__ == "__main__":
+    main()
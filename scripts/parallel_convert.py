@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+BookToNotes - Chapter-parallel EPUB conversion
+Splits an EPUB spine into chapter groups, converts the groups concurrently
+with Calibre and merges the resulting PDFs (page order and bookmarks kept).
+
+Requires pypdf for merging: pip install pypdf
+
+Usage:
+  python parallel_convert.py "book.epub" "book.pdf"
+  python parallel_convert.py "book.epub" "book.pdf" -w 4
+"""
+
+import os
+import sys
+
+# Fix Windows encoding
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+    os.environ['PYTHONIOENCODING'] = 'utf-8'
+
+import argparse
+import posixpath
+import re
+import shutil
+import subprocess
+import tempfile
+import xml.etree.ElementTree as ET
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import unquote
+
+from config import (
+    CALIBRE_PATH, TEMP_DIR,
+    PARALLEL_CONVERT_WORKERS, PARALLEL_CONVERT_MIN_SIZE
+)
+import storage
+
+try:
+    from pypdf import PdfWriter
+except ImportError:
+    PdfWriter = None
+
+CONTAINER_PATH = "META-INF/container.xml"
+NS = {
+    "container": "urn:oasis:names:tc:opendocument:xmlns:container",
+    "opf": "http://www.idpf.org/2007/opf",
+    "ncx": "http://www.daisy.org/z3986/2005/ncx/",
+    "xhtml": "http://www.w3.org/1999/xhtml",
+    "epub": "http://www.idpf.org/2007/ops",
+}
+HTML_TYPES = ("application/xhtml+xml", "text/html")
+
+# Keep the epub: prefix when a rewritten nav document is serialized
+ET.register_namespace("epub", NS["epub"])
+
+
+def log(msg: str, level: str = "INFO"):
+    icons = {"INFO": "[INFO]", "SUCCESS": "[OK]", "ERROR": "[ERROR]", "WARN": "[WARN]", "STEP": "[STEP]"}
+    print(f"{icons.get(level, '')} {msg}")
+
+
+def get_workers() -> int:
+    return PARALLEL_CONVERT_WORKERS or os.cpu_count() or 1
+
+
+# =============================================================================
+# EPUB spine handling
+# =============================================================================
+
+def find_opf(zf: zipfile.ZipFile) -> str:
+    root = ET.fromstring(zf.read(CONTAINER_PATH))
+    rootfile = root.find(".//container:rootfile", NS)
+    if rootfile is None:
+        raise ValueError("No rootfile in container.xml")
+    return rootfile.get("full-path")
+
+
+def read_spine(epub_path: Path) -> tuple:
+    """Return (opf_path, opf_text, [(idref, size_bytes), ...]) in reading order"""
+    with zipfile.ZipFile(epub_path) as zf:
+        opf_path = find_opf(zf)
+        opf_bytes = zf.read(opf_path)
+        names = {info.filename: info.file_size for info in zf.infolist()}
+
+    root = ET.fromstring(opf_bytes)
+    opf_dir = posixpath.dirname(opf_path)
+    hrefs = {
+        item.get("id"): posixpath.normpath(posixpath.join(opf_dir, item.get("href", "")))
+        for item in root.iterfind(".//opf:manifest/opf:item", NS)
+    }
+
+    spine = []
+    for itemref in root.iterfind(".//opf:spine/opf:itemref", NS):
+        idref = itemref.get("idref")
+        spine.append((idref, names.get(hrefs.get(idref), 0)))
+
+    return opf_path, opf_bytes.decode("utf-8"), spine
+
+
+def read_manifest(opf_path: str, opf_text: str) -> dict:
+    """Map manifest id -> item attributes, with 'path' resolved inside the zip"""
+    root = ET.fromstring(opf_text.encode("utf-8"))
+    opf_dir = posixpath.dirname(opf_path)
+    items = {}
+    for item in root.iterfind(".//opf:manifest/opf:item", NS):
+        attrs = dict(item.attrib)
+        attrs["path"] = resolve_href(opf_dir, attrs.get("href", ""))
+        items[attrs.get("id")] = attrs
+    return items
+
+
+def resolve_href(base_dir: str, href: str) -> str:
+    """Zip path of a relative link, without its fragment"""
+    return posixpath.normpath(posixpath.join(base_dir, unquote(href.split("#", 1)[0])))
+
+
+def group_spine(spine: list, groups: int) -> list:
+    """Split spine into contiguous groups of roughly equal byte size"""
+    groups = max(1, min(groups, len(spine)))
+    total = sum(size or 1 for _, size in spine)
+    target = total / groups
+
+    result, current, cumulative = [], [], 0
+    for i, (idref, size) in enumerate(spine):
+        current.append(idref)
+        cumulative += size or 1
+        remaining_items = len(spine) - i - 1
+        remaining_groups = groups - len(result) - 1
+        if remaining_groups and (cumulative >= target * (len(result) + 1) or remaining_items == remaining_groups):
+            result.append(current)
+            current = []
+    if current:
+        result.append(current)
+    return result
+
+
+def rewrite_spine(opf_text: str, keep: list, keep_cover: bool) -> str:
+    """Return OPF text whose spine only references the given idrefs"""
+    keep = set(keep)
+
+    def filter_itemref(match):
+        idref = re.search(r'idref\s*=\s*["\']([^"\']+)["\']', match.group(0))
+        return match.group(0) if idref and idref.group(1) in keep else ""
+
+    spine_match = re.search(r'<(\w+:)?spine\b.*?</(\w+:)?spine>', opf_text, re.S)
+    spine = re.sub(r'<(\w+:)?itemref\b[^>]*?(/>|>\s*</(\w+:)?itemref>)', filter_itemref, spine_match.group(0))
+    opf_text = opf_text[:spine_match.start()] + spine + opf_text[spine_match.end():]
+
+    if not keep_cover:
+        # Only the first part carries the cover page
+        opf_text = re.sub(r'<(\w+:)?meta\b[^>]*name\s*=\s*["\']cover["\'][^>]*/>', '', opf_text)
+        opf_text = re.sub(r'<(\w+:)?reference\b[^>]*type\s*=\s*["\']cover["\'][^>]*/>', '', opf_text)
+
+    return opf_text
+
+
+def drop_manifest_items(opf_text: str, drop_ids: set, drop_hrefs: set) -> str:
+    """
+    Remove manifest items (and guide references to them) from OPF text.
+    Calibre appends any manifest document that is linked from the spine, so
+    chapters of other groups must not be in a part's manifest at all.
+    """
+    def filter_tag(attr, values):
+        def repl(match):
+            value = re.search(attr + r'\s*=\s*["\']([^"\']+)["\']', match.group(0))
+            return "" if value and value.group(1).split("#", 1)[0] in values else match.group(0)
+        return repl
+
+    opf_text = re.sub(r'<(\w+:)?item\b[^>]*?(/>|>\s*</(\w+:)?item>)', filter_tag(r'\bid', drop_ids), opf_text)
+    opf_text = re.sub(r'<(\w+:)?reference\b[^>]*?/>', filter_tag(r'\bhref', drop_hrefs), opf_text)
+    return opf_text
+
+
+def prune_toc(container, entry_tag: str, nested, target, dropped: set):
+    """
+    Remove TOC entries that point into dropped documents. Children of a
+    removed entry take its place, so the part keeps an outline of its own
+    chapters only and the merged PDF gets each bookmark once.
+    """
+    for entry in list(container):
+        if entry.tag != entry_tag:
+            continue
+        sub = nested(entry)
+        if sub is not None:
+            prune_toc(sub, entry_tag, nested, target, dropped)
+        if target(entry) not in dropped:
+            continue
+        position = list(container).index(entry)
+        container.remove(entry)
+        if sub is not None:
+            for offset, child in enumerate([c for c in sub if c.tag == entry_tag]):
+                container.insert(position + offset, child)
+
+
+def prune_ncx(ncx_bytes: bytes, ncx_path: str, dropped: set) -> bytes:
+    ET.register_namespace("", NS["ncx"])
+    root = ET.fromstring(ncx_bytes)
+    base_dir = posixpath.dirname(ncx_path)
+    nav_point = f"{{{NS['ncx']}}}navPoint"
+
+    def target(entry):
+        content = entry.find("ncx:content", NS)
+        return resolve_href(base_dir, content.get("src", "")) if content is not None else None
+
+    nav_map = root.find("ncx:navMap", NS)
+    if nav_map is not None:
+        prune_toc(nav_map, nav_point, lambda entry: entry, target, dropped)
+    return ET.tostring(root, encoding="utf-8", xml_declaration=True)
+
+
+def prune_nav(nav_bytes: bytes, nav_path: str, dropped: set) -> bytes:
+    ET.register_namespace("", NS["xhtml"])
+    root = ET.fromstring(nav_bytes)
+    base_dir = posixpath.dirname(nav_path)
+    list_item = f"{{{NS['xhtml']}}}li"
+
+    def target(entry):
+        link = entry.find("xhtml:a", NS)
+        return resolve_href(base_dir, link.get("href", "")) if link is not None else None
+
+    for nav in root.iter(f"{{{NS['xhtml']}}}nav"):
+        for ol in nav.findall("xhtml:ol", NS):
+            prune_toc(ol, list_item, lambda entry: entry.find("xhtml:ol", NS), target, dropped)
+    return ET.tostring(root, encoding="utf-8", xml_declaration=True)
+
+
+def write_part(epub_path: Path, replace: dict, skip: set, out_path: Path):
+    """
+    Copy the EPUB, replacing the contents of some entries and leaving out
+    others. The mimetype entry stays first and uncompressed.
+    """
+    with zipfile.ZipFile(epub_path) as src, zipfile.ZipFile(out_path, "w", zipfile.ZIP_DEFLATED) as dst:
+        if "mimetype" in src.namelist():
+            dst.writestr("mimetype", src.read("mimetype"), compress_type=zipfile.ZIP_STORED)
+        for info in src.infolist():
+            if info.filename == "mimetype" or info.filename in skip:
+                continue
+            if info.filename in replace:
+                dst.writestr(info.filename, replace[info.filename])
+            else:
+                dst.writestr(info, src.read(info.filename))
+
+
+def split_epub(epub_path: Path, groups: int, out_dir: Path) -> list:
+    """
+    Write one sub-EPUB per chapter group. Each part only contains its own
+    chapters, and its NCX/nav table of contents is pruned to match.
+    Returns the part paths in reading order.
+    """
+    opf_path, opf_text, spine = read_spine(epub_path)
+    manifest = read_manifest(opf_path, opf_text)
+    grouped = group_spine(spine, groups)
+
+    with zipfile.ZipFile(epub_path) as zf:
+        names = set(zf.namelist())
+        tocs = {}
+        for item in manifest.values():
+            if item["path"] not in names:
+                continue
+            if item.get("media-type") == "application/x-dtbncx+xml":
+                tocs[item["path"]] = (prune_ncx, zf.read(item["path"]))
+            elif "nav" in item.get("properties", "").split():
+                tocs[item["path"]] = (prune_nav, zf.read(item["path"]))
+
+    parts = []
+    for i, idrefs in enumerate(grouped):
+        others = {idref for j, group in enumerate(grouped) if j != i for idref in group} - set(idrefs)
+        drop = {idref for idref in others
+                if idref in manifest and manifest[idref].get("media-type") in HTML_TYPES}
+        dropped = {manifest[idref]["path"] for idref in drop}
+
+        part_opf = rewrite_spine(opf_text, idrefs, keep_cover=(i == 0))
+        part_opf = drop_manifest_items(part_opf, drop, {manifest[idref].get("href") for idref in drop})
+        replace = {opf_path: part_opf.encode("utf-8")}
+        for toc_path, (prune, toc_bytes) in tocs.items():
+            if toc_path not in dropped:
+                replace[toc_path] = prune(toc_bytes, toc_path, dropped)
+
+        part_path = out_dir / f"part{i:03d}.epub"
+        write_part(epub_path, replace, dropped, part_path)
+        parts.append(part_path)
+    return parts
+
+
+# =============================================================================
+# Conversion and merge
+# =============================================================================
+
+def convert_part(part: Path, first: bool) -> Path:
+    output = part.with_suffix(".pdf")
+    cmd = [CALIBRE_PATH, str(part), str(output)]
+    if not first:
+        cmd.append("--no-default-epub-cover")
+    result = subprocess.run(
+        cmd,
+        capture_output=True,
+        text=True,
+        encoding='utf-8',
+        errors='replace'
+    )
+    if result.returncode != 0 or not output.exists():
+        raise RuntimeError(f"{part.name}: {result.stderr[:200]}")
+    return output
+
+
+def merge_pdfs(pdfs: list, output_file: Path):
+    writer = PdfWriter()
+    for pdf in pdfs:
+        writer.append(str(pdf), import_outline=True)
+    with open(output_file, "wb") as f:
+        writer.write(f)
+
+
+def should_parallelize(input_file: Path) -> bool:
+    if input_file.suffix.lower() != ".epub" or PdfWriter is None:
+        return False
+    if get_workers() < 2:
+        return False
+    return input_file.stat().st_size >= PARALLEL_CONVERT_MIN_SIZE
+
+
+def convert_epub_parallel(input_file: Path, output_file: Path, workers: int = None) -> bool:
+    """Convert an EPUB to PDF using several Calibre processes. Returns False on failure."""
+    if PdfWriter is None:
+        log("pypdf not installed. Run: pip install pypdf", "ERROR")
+        return False
+
+    workers = workers or get_workers()
+    TEMP_DIR.mkdir(parents=True, exist_ok=True)
+    work_dir = Path(tempfile.mkdtemp(prefix="split-", dir=TEMP_DIR))
+    work_pin = storage.pin(work_dir)
+
+    try:
+        try:
+            parts = split_epub(input_file, workers, work_dir)
+        except (KeyError, ValueError, zipfile.BadZipFile, ET.ParseError, AttributeError) as e:
+            log(f"Cannot split EPUB: {e}", "WARN")
+            return False
+
+        if len(parts) < 2:
+            return False
+
+        log(f"Converting {len(parts)} chapter groups on {workers} workers...", "STEP")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(convert_part, part, i == 0) for i, part in enumerate(parts)]
+            try:
+                pdfs = [f.result() for f in futures]
+            except RuntimeError as e:
+                log(f"Part conversion failed: {e}", "WARN")
+                return False
+
+        log("Merging parts...", "STEP")
+        try:
+            merge_pdfs(pdfs, output_file)
+        except Exception as e:
+            log(f"Merging parts failed: {e}", "WARN")
+            try:
+                output_file.unlink()
+            except FileNotFoundError:
+                pass
+            return False
+        return output_file.exists()
+
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        storage.unpin(work_pin)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chapter-parallel EPUB to PDF conversion')
+    parser.add_argument('input', help='EPUB file')
+    parser.add_argument('output', help='Output PDF file')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                       help='Number of parallel Calibre processes (default: CPU count)')
+    args = parser.parse_args()
+
+    ok = convert_epub_parallel(Path(args.input), Path(args.output), args.workers)
+    if ok:
+        log(f"Converted: {args.output}", "SUCCESS")
+    else:
+        log("Parallel conversion failed", "ERROR")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ Usage:
   python prepare.py "book title"                    # Download from Zlib and upload
   python prepare.py "book title" -i                 # Interactive mode
   python prepare.py --file "path/to/book.epub" --name "Book Name"  # Local file
+  python prepare.py "book title" --restart          # Ignore stages finished by a previous run
 """
 
 import os
@@ -29,8 +30,14 @@ from pathlib import Path
 
 from config import (
     CALIBRE_PATH, NOTEBOOKLM_SKILL_DIR,
-    DOWNLOAD_DIR, OUTPUT_DIR, TEMP_DIR
+    DOWNLOAD_DIR, OUTPUT_DIR, TEMP_DIR,
+    STORAGE_GC_INLINE, STAGE_MAX_ATTEMPTS, FINGERPRINT_REUSE
 )
+import storage
+import parallel_convert
+from journal import StageJournal, StageFailed, book_key, run_with_retries
+import fingerprint
+from integrity import IntegrityError, validate_file
 
 # Supported ebook formats
 SUPPORTED_FORMATS = ['.epub', '.pdf', '.mobi', '.azw', '.azw3', '.txt', '.docx']
@@ -85,19 +92,18 @@ def check_dependencies():
 
 
 def download_from_zlib(query: str, interactive: bool = False) -> Path:
-    """Download book from Zlib"""
+    """Download book from Zlib. Raises with the reason on failure."""
     log(f"Downloading from Zlib: {query}", "STEP")
 
     try:
         from zlib_download import ZlibDownloader
     except ImportError:
-        log("Cannot import zlib_download module", "ERROR")
-        return None
+        raise RuntimeError("cannot import zlib_download module")
 
     async def do_download():
         downloader = ZlibDownloader()
         if not await downloader.connect():
-            return None
+            raise RuntimeError("Telegram client could not connect")
 
         try:
             filepath = await downloader.search_and_download(
@@ -105,22 +111,22 @@ def download_from_zlib(query: str, interactive: bool = False) -> Path:
                 auto_select=not interactive,
                 select_index=None
             )
+            if not filepath and downloader.last_error == "integrity":
+                # Every candidate was already tried; searching again will not help
+                raise IntegrityError("all downloaded candidates were corrupt")
+            if not filepath:
+                raise RuntimeError(downloader.failure_reason())
             return filepath
         finally:
             await downloader.disconnect()
 
     filepath = asyncio.run(do_download())
-
-    if filepath and filepath.exists():
-        log(f"Downloaded: {filepath}", "SUCCESS")
-        return filepath
-    else:
-        log("Download failed", "ERROR")
-        return None
+    log(f"Downloaded: {filepath}", "SUCCESS")
+    return filepath
 
 
 def convert_to_pdf(input_file: Path, book_name: str) -> Path:
-    """Convert to PDF format if not already PDF"""
+    """Convert to PDF format if not already PDF. Raises with Calibre's error on failure."""
     TEMP_DIR.mkdir(parents=True, exist_ok=True)
     output_file = TEMP_DIR / f"{book_name}.pdf"
 
@@ -131,6 +137,14 @@ def convert_to_pdf(input_file: Path, book_name: str) -> Path:
         log(f"Copied to: {output_file}", "SUCCESS")
         return output_file
 
+    # Large EPUBs: convert chapter groups on several cores
+    if parallel_convert.should_parallelize(input_file):
+        log(f"Converting {input_file.suffix} -> PDF (chapter-parallel)...", "STEP")
+        if parallel_convert.convert_epub_parallel(input_file, output_file):
+            log(f"Converted: {output_file}", "SUCCESS")
+            return output_file
+        log("Falling back to single-process conversion", "WARN")
+
     # Otherwise convert with Calibre
     log(f"Converting {input_file.suffix} -> PDF...", "STEP")
 
@@ -144,19 +158,17 @@ def convert_to_pdf(input_file: Path, book_name: str) -> Path:
     )
 
     if result.returncode != 0:
-        log(f"Conversion failed: {result.stderr[:200]}", "ERROR")
-        return None
+        raise RuntimeError(f"Calibre exited with {result.returncode}: {result.stderr.strip()[:200]}")
 
-    if output_file.exists():
-        log(f"Converted: {output_file}", "SUCCESS")
-        return output_file
-    else:
-        log("Conversion failed: output file not created", "ERROR")
-        return None
+    if not output_file.exists():
+        raise RuntimeError("Calibre did not create the output file")
+
+    log(f"Converted: {output_file}", "SUCCESS")
+    return output_file
 
 
 def upload_to_notebooklm(pdf_file: Path, book_name: str) -> tuple:
-    """Upload to NotebookLM"""
+    """Upload to NotebookLM. Returns (notebook_id, notebook_url); raises on failure."""
     log(f"Uploading to NotebookLM: {book_name}", "STEP")
 
     if os.name == 'nt':
@@ -207,11 +219,11 @@ def upload_to_notebooklm(pdf_file: Path, book_name: str) -> tuple:
             library_id = book_name.lower().replace(' ', '-').replace('_', '-')
             return library_id, None
 
-        log("Upload failed", "ERROR")
-        return None, None
+        raise RuntimeError("no notebook URL in upload_file.py output")
 
 
-def prepare_book(query: str = None, file_path: str = None, book_name: str = None, interactive: bool = False):
+def prepare_book(query: str = None, file_path: str = None, book_name: str = None, interactive: bool = False,
+                 fetch=None, restart: bool = False, reuse: str = None, upload=None):
     """
     Complete book preparation workflow
 
@@ -220,6 +232,15 @@ def prepare_book(query: str = None, file_path: str = None, book_name: str = None
         file_path: Local file path
         book_name: Custom book name
         interactive: Interactive mode for search results
+        fetch: Optional callable(query, interactive) -> Path replacing download_from_zlib
+               (used by service.py to reuse a warm Telegram client). It raises
+               IntegrityError when every candidate was corrupt, which is not retried.
+        restart: Ignore the stage journal and run every stage again
+        reuse: Near-duplicate handling, "ask", "always" or "never" (default: FINGERPRINT_REUSE)
+        upload: Optional callable(pdf_file, book_name) -> (notebook_id, notebook_url) replacing
+                upload_to_notebooklm (used by work_queue.py to tie the upload to the job lease)
+
+    Returns the result dict. Raises StageFailed naming the stage that failed and why.
     """
     print("\n" + "=" * 60)
     print("BookToNotes - Preparation")
@@ -227,32 +248,89 @@ def prepare_book(query: str = None, file_path: str = None, book_name: str = None
 
     # Check dependencies
     if not check_dependencies():
+        raise StageFailed('Dependencies', "Calibre or the NotebookLM skill is not set up")
+
+    pins = []
+    try:
+        return _run_stages(query, file_path, book_name, interactive, pins,
+                           fetch or download_from_zlib, restart, reuse or FINGERPRINT_REUSE,
+                           upload or upload_to_notebooklm)
+    finally:
+        # Housekeeping must never turn a finished preparation into a failure
+        try:
+            for pin_file in pins:
+                storage.unpin(pin_file)
+            if STORAGE_GC_INLINE:
+                storage.collect_garbage()
+        except Exception as e:
+            log(f"Storage cleanup failed: {e}", "WARN")
+
+
+def find_prepared_duplicate(fp: dict, reuse: str, interactive: bool) -> dict:
+    """
+    Return the index entry whose notebook should be reused, or None.
+    Metadata-only matches are never reused without confirmation.
+    """
+    matches = fingerprint.FingerprintIndex().find_duplicates(fp, prepared_only=True)
+    if not matches:
         return None
 
-    # Determine input file
-    input_file = None
+    score, basis, entry = matches[0]
+    log(f"Near-duplicate of an already prepared book ({score:.0%} {basis} match):", "WARN")
+    log(f"  {entry['path']}", "INFO")
+    log(f"  Notebook: {entry.get('notebook_url') or entry['notebook_id']}", "INFO")
+
+    if reuse == "always" and basis != 'metadata':
+        return entry
+    if reuse != "never" and interactive:
+        try:
+            answer = input("Reuse the existing notebook instead of uploading again? [Y/n]: ")
+        except EOFError:
+            answer = 'n'
+        if answer.strip().lower() in ('', 'y', 'yes'):
+            return entry
+    return None
 
+
+def _run_stages(query, file_path, book_name, interactive, pins, fetch, restart, reuse, upload):
+    """Run download/convert/upload; artifacts in use are appended to pins"""
+    if not query and not file_path:
+        raise StageFailed('Input', "provide either a search query or a file path")
+
+    journal = StageJournal(book_key(query, file_path))
+    if restart:
+        journal.reset()
+
+    # Determine input file
     if file_path:
         # Use local file
         input_file = Path(file_path)
         if not input_file.exists():
-            log(f"File not found: {input_file}", "ERROR")
-            return None
+            raise StageFailed('Input', f"file not found: {input_file}")
         if input_file.suffix.lower() not in SUPPORTED_FORMATS:
-            log(f"Unsupported format: {input_file.suffix}", "ERROR")
-            log(f"Supported: {', '.join(SUPPORTED_FORMATS)}", "INFO")
-            return None
+            raise StageFailed('Input', f"unsupported format {input_file.suffix} "
+                                       f"(supported: {', '.join(SUPPORTED_FORMATS)})")
+        try:
+            validate_file(input_file)
+        except IntegrityError as e:
+            raise StageFailed('Input', f"corrupt file: {e}")
         log(f"Using local file: {input_file}", "INFO")
-
-    elif query:
-        # Download from Zlib
-        input_file = download_from_zlib(query, interactive)
-        if not input_file:
-            return None
+        if not journal.completed('download'):
+            journal.record('download', input_file)
 
     else:
-        log("Please provide either a search query or a file path", "ERROR")
-        return None
+        done = journal.completed('download')
+        if done:
+            input_file = Path(done['path'])
+            log(f"Resuming: already downloaded {input_file}", "INFO")
+        else:
+            # Download from Zlib (no retries when a user is picking results)
+            input_file = run_with_retries('Download', fetch, query, interactive,
+                                          attempts=1 if interactive else STAGE_MAX_ATTEMPTS,
+                                          fatal=(IntegrityError,))
+            journal.record('download', input_file)
+
+    pins.append(storage.pin(input_file))
 
     # Determine book name
     if not book_name:
@@ -261,16 +339,53 @@ def prepare_book(query: str = None, file_path: str = None, book_name: str = None
 
     log(f"Book name: {book_name}", "INFO")
 
+    # Skip conversion and upload for near-duplicates of prepared books.
+    # The fingerprint is indexed even with reuse "never" so later runs can match it.
+    fp = None
+    if not journal.completed('upload'):
+        log("Fingerprinting...", "STEP")
+        fp = fingerprint.compute(input_file)
+        duplicate = find_prepared_duplicate(fp, reuse, interactive) if reuse != "never" else None
+        if duplicate:
+            fingerprint.FingerprintIndex().add(fp, pdf_file=duplicate.get('pdf_file'),
+                                               notebook_id=duplicate['notebook_id'],
+                                               notebook_url=duplicate.get('notebook_url'))
+            return report_result(book_name, input_file, duplicate.get('pdf_file'),
+                                 duplicate['notebook_id'], duplicate.get('notebook_url'),
+                                 reused_from=duplicate['path'])
+
     # Convert to PDF
-    pdf_file = convert_to_pdf(input_file, book_name)
-    if not pdf_file:
-        return None
+    pins.append(storage.pin(TEMP_DIR / f"{book_name}.pdf"))
+    done = journal.completed('convert')
+    if done and done.get('book_name') == book_name:
+        pdf_file = Path(done['path'])
+        log(f"Resuming: already converted {pdf_file}", "INFO")
+    else:
+        # Calibre failures are deterministic, so conversion is not retried
+        pdf_file = run_with_retries('Conversion', convert_to_pdf, input_file, book_name, attempts=1)
+        journal.record('convert', pdf_file, book_name=book_name)
 
     # Upload to NotebookLM
-    notebook_id, notebook_url = upload_to_notebooklm(pdf_file, book_name)
-    if not notebook_id:
-        return None
+    done = journal.completed('upload')
+    if done and done.get('book_name') == book_name:
+        notebook_id, notebook_url = done['notebook_id'], done.get('notebook_url')
+        log(f"Resuming: already uploaded as {notebook_id}", "INFO")
+    else:
+        notebook_id, notebook_url = run_with_retries('Upload', upload, pdf_file, book_name)
+        journal.record('upload', notebook_id=notebook_id, notebook_url=notebook_url, book_name=book_name)
+
+    storage.touch(input_file, pdf_file)
+
+    if fp:
+        fingerprint.FingerprintIndex().add(fp, book_name=book_name, pdf_file=str(pdf_file),
+                                           notebook_id=notebook_id, notebook_url=notebook_url)
+
+    return report_result(book_name, input_file, pdf_file, notebook_id, notebook_url)
 
+
+def report_result(book_name: str, input_file: Path, pdf_file: Path, notebook_id: str, notebook_url: str,
+                  reused_from: str = None) -> dict:
+    """Print the summary and RESULT JSON block"""
     # Ensure output directory exists
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -284,6 +399,8 @@ def prepare_book(query: str = None, file_path: str = None, book_name: str = None
     print(f"Notebook ID: {notebook_id}")
     if notebook_url:
         print(f"Notebook URL: {notebook_url}")
+    if reused_from:
+        print(f"Reused From: {reused_from}")
     print(f"Output Directory: {OUTPUT_DIR}")
     print("=" * 60 + "\n")
 
@@ -291,11 +408,13 @@ def prepare_book(query: str = None, file_path: str = None, book_name: str = None
         "success": True,
         "book_name": book_name,
         "source_file": str(input_file),
-        "pdf_file": str(pdf_file),
+        "pdf_file": str(pdf_file) if pdf_file else None,
         "notebook_id": notebook_id,
         "notebook_url": notebook_url,
         "output_dir": str(OUTPUT_DIR)
     }
+    if reused_from:
+        result["reused_from"] = reused_from
 
     print("--- RESULT JSON ---")
     print(json.dumps(result, ensure_ascii=False, indent=2))
@@ -313,6 +432,10 @@ def main():
     parser.add_argument('--name', '-n', help='Custom book name')
     parser.add_argument('-i', '--interactive', action='store_true',
                        help='Interactive mode - choose from search results')
+    parser.add_argument('--restart', action='store_true',
+                       help='Ignore completed stages from a previous run')
+    parser.add_argument('--reuse', choices=['ask', 'always', 'never'], default=None,
+                       help='Reuse the notebook of an already prepared near-duplicate (default: config)')
     args = parser.parse_args()
 
     if not args.query and not args.file:
@@ -320,14 +443,20 @@ def main():
         print("\nError: Please provide either a book title or --file path")
         sys.exit(1)
 
-    result = prepare_book(
-        query=args.query,
-        file_path=args.file,
-        book_name=args.name,
-        interactive=args.interactive
-    )
+    try:
+        prepare_book(
+            query=args.query,
+            file_path=args.file,
+            book_name=args.name,
+            interactive=args.interactive,
+            restart=args.restart,
+            reuse=args.reuse
+        )
+    except StageFailed as e:
+        log(f"Preparation failed at {e}", "ERROR")
+        sys.exit(1)
 
-    sys.exit(0 if result else 1)
+    sys.exit(0)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+BookToNotes - Local Job Service
+Long-lived HTTP service wrapping prepare_book with a persistent job queue.
+One Telegram client and a pool of workers stay warm across jobs.
+
+Usage:
+  python service.py                      # Listen on SERVICE_HOST:SERVICE_PORT
+  python service.py --port 9000 -w 4     # Custom port / worker count
+
+Endpoints (JSON):
+  POST /jobs               {"query": "..."} or {"file": "...", "name": "..."}
+  GET  /jobs               List recent jobs
+  GET  /jobs/<id>          Job status
+  GET  /jobs/<id>/result   Result of a finished job
+  GET  /health             Service status
+"""
+
+import os
+import sys
+
+# Fix Windows encoding
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+    os.environ['PYTHONIOENCODING'] = 'utf-8'
+
+import argparse
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from config import DATA_DIR, SERVICE_HOST, SERVICE_PORT, SERVICE_WORKERS, FINGERPRINT_REUSE_UNATTENDED
+from integrity import IntegrityError
+from journal import StageFailed
+from prepare import prepare_book
+
+QUEUE_DB = DATA_DIR / "jobs.db"
+
+
+def log(msg: str, level: str = "INFO"):
+    icons = {"INFO": "[INFO]", "SUCCESS": "[OK]", "ERROR": "[ERROR]", "WARN": "[WARN]", "STEP": "[STEP]"}
+    print(f"{icons.get(level, '')} {msg}")
+
+
+# =============================================================================
+# Persistent job queue
+# =============================================================================
+
+class JobQueue:
+    """SQLite-backed FIFO queue. Jobs survive service restarts."""
+
+    def __init__(self, db_path: Path = QUEUE_DB):
+        self.db_path = db_path
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.wakeup = threading.Condition()
+        with closing(self._connect()) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+
+    def recover(self) -> int:
+        """Re-queue jobs left running by a previous process"""
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'"
+            )
+            return cur.rowcount
+
+    def submit(self, params: dict) -> str:
+        job_id = uuid.uuid4().hex[:12]
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, params, created_at) VALUES (?, 'queued', ?, ?)",
+                (job_id, json.dumps(params, ensure_ascii=False), time.time())
+            )
+        with self.wakeup:
+            self.wakeup.notify()
+        return job_id
+
+    def claim(self):
+        """Atomically move the oldest queued job to running. Returns (id, params) or None."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, params FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if not row:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?",
+                (time.time(), row[0])
+            )
+            conn.execute("COMMIT")
+            return row[0], json.loads(row[1])
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def wait_and_claim(self, timeout: float = 1.0):
+        job = self.claim()
+        if job:
+            return job
+        with self.wakeup:
+            self.wakeup.wait(timeout)
+        return self.claim()
+
+    def finish(self, job_id: str, result: dict):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, finished_at = ? WHERE id = ?",
+                (json.dumps(result, ensure_ascii=False), time.time(), job_id)
+            )
+
+    def fail(self, job_id: str, error: str):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                (error, time.time(), job_id)
+            )
+
+    def get(self, job_id: str):
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, limit: int = 50) -> list:
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                "SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    def counts(self) -> dict:
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    @staticmethod
+    def _to_dict(row) -> dict:
+        return {
+            "id": row["id"],
+            "status": row["status"],
+            "params": json.loads(row["params"]),
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+        }
+
+
+# =============================================================================
+# Warm Telegram client
+# =============================================================================
+
+class WarmZlibClient:
+    """One Telegram connection shared by all jobs, driven from its own event loop thread"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.downloader = None
+        self.lock = None
+        self.connected = False
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def _connect(self):
+        try:
+            from zlib_download import ZlibDownloader
+        except (ImportError, SystemExit):
+            log("Cannot import zlib_download module", "ERROR")
+            return False
+
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        self.downloader = ZlibDownloader()
+        return await self.downloader.connect()
+
+    async def _download(self, query: str):
+        # The bot conversation is sequential, so searches are serialized
+        async with self.lock:
+            if not self.downloader.client.is_connected():
+                await self.downloader.client.connect()
+            filepath = await self.downloader.search_and_download(query, auto_select=True)
+            if not filepath and self.downloader.last_error == "integrity":
+                raise IntegrityError("all downloaded candidates were corrupt")
+            if not filepath:
+                raise RuntimeError(self.downloader.failure_reason())
+            return filepath
+
+    def start(self) -> bool:
+        self.thread.start()
+        self.connected = self._call(self._connect())
+        if not self.connected:
+            log("Telegram client unavailable; only file jobs will succeed", "WARN")
+        return self.connected
+
+    def stop(self):
+        if self.downloader:
+            self._call(self.downloader.disconnect())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def fetch(self, query: str, interactive: bool = False) -> Path:
+        """Drop-in replacement for prepare.download_from_zlib"""
+        if not self.connected:
+            raise RuntimeError("Telegram client not connected")
+
+        log(f"Downloading from Zlib: {query}", "STEP")
+        filepath = self._call(self._download(query))
+        log(f"Downloaded: {filepath}", "SUCCESS")
+        return filepath
+
+
+# =============================================================================
+# Workers and HTTP API
+# =============================================================================
+
+class JobService:
+    def __init__(self, workers: int = SERVICE_WORKERS):
+        self.queue = JobQueue()
+        self.zlib = WarmZlibClient()
+        self.workers = workers
+        self.stopping = threading.Event()
+        self.threads = []
+
+    def start(self):
+        recovered = self.queue.recover()
+        if recovered:
+            log(f"Re-queued {recovered} interrupted jobs", "INFO")
+
+        self.zlib.start()
+
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"worker-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def stop(self):
+        self.stopping.set()
+        with self.queue.wakeup:
+            self.queue.wakeup.notify_all()
+        for t in self.threads:
+            t.join(timeout=5)
+        self.zlib.stop()
+
+    def _worker(self):
+        while not self.stopping.is_set():
+            job = self.queue.wait_and_claim()
+            if not job:
+                continue
+            job_id, params = job
+            log(f"Job {job_id} started: {params}", "STEP")
+            try:
+                result = prepare_book(
+                    query=params.get("query"),
+                    file_path=params.get("file"),
+                    book_name=params.get("name"),
+                    fetch=self.zlib.fetch,
+                    reuse=FINGERPRINT_REUSE_UNATTENDED
+                )
+            except StageFailed as e:
+                log(f"Job {job_id} failed at {e}", "ERROR")
+                self.queue.fail(job_id, str(e))
+                continue
+            except Exception as e:
+                log(f"Job {job_id} crashed: {e}", "ERROR")
+                self.queue.fail(job_id, f"crashed: {type(e).__name__}: {e}")
+                continue
+
+            self.queue.finish(job_id, result)
+            log(f"Job {job_id} done", "SUCCESS")
+
+
+def make_handler(service: JobService):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            log(f"{self.address_string()} {format % args}", "INFO")
+
+        def do_GET(self):
+            parts = [p for p in self.path.split('?')[0].split('/') if p]
+
+            if parts == ["health"]:
+                return self._send(200, {
+                    "status": "ok",
+                    "telegram_connected": service.zlib.connected,
+                    "workers": service.workers,
+                    "jobs": service.queue.counts(),
+                })
+
+            if parts == ["jobs"]:
+                return self._send(200, {"jobs": service.queue.list()})
+
+            if len(parts) in (2, 3) and parts[0] == "jobs":
+                job = service.queue.get(parts[1])
+                if not job:
+                    return self._send(404, {"error": "Job not found"})
+
+                if len(parts) == 2:
+                    job.pop("result")
+                    return self._send(200, job)
+
+                if parts[2] == "result":
+                    if job["status"] == "done":
+                        return self._send(200, job["result"])
+                    if job["status"] == "failed":
+                        return self._send(200, {"success": False, "error": job["error"]})
+                    return self._send(409, {"error": "Job not finished", "status": job["status"]})
+
+            self._send(404, {"error": "Not found"})
+
+        def do_POST(self):
+            if self.path.split('?')[0].rstrip('/') != "/jobs":
+                return self._send(404, {"error": "Not found"})
+
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+            except ValueError:
+                return self._send(400, {"error": "Invalid Content-Length"})
+            if length < 0:
+                # rfile.read(-1) would block until the client closes the connection
+                return self._send(400, {"error": "Invalid Content-Length"})
+
+            try:
+                params = json.loads(self.rfile.read(length) or b"{}")
+            except (ValueError, json.JSONDecodeError):
+                return self._send(400, {"error": "Invalid JSON body"})
+
+            if not isinstance(params, dict) or not (params.get("query") or params.get("file")):
+                return self._send(400, {"error": "Provide either 'query' or 'file'"})
+
+            params = {k: params[k] for k in ("query", "file", "name") if params.get(k)}
+            job_id = service.queue.submit(params)
+            self._send(202, {"id": job_id, "status": "queued"})
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BookToNotes local job service')
+    parser.add_argument('--host', default=SERVICE_HOST, help='Bind address')
+    parser.add_argument('--port', '-p', type=int, default=SERVICE_PORT, help='Port')
+    parser.add_argument('--workers', '-w', type=int, default=SERVICE_WORKERS,
+                       help='Concurrent jobs')
+    args = parser.parse_args()
+
+    service = JobService(workers=args.workers)
+    service.start()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    log(f"Listening on http://{args.host}:{args.port}", "SUCCESS")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log("Shutting down...", "INFO")
+    finally:
+        server.server_close()
+        service.stop()
+
+
+if __name__ == "__main__":
+    main()
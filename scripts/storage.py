@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+BookToNotes - Storage Manager
+Keeps downloads/, temp/ and output/ within their byte budgets by evicting
+least-recently-used artifacts. Files used by a running job are pinned and
+never evicted.
+
+Usage:
+  python storage.py status          # Show usage per directory
+  python storage.py gc              # Evict until every directory fits its budget
+  python storage.py gc --dry-run    # Show what would be evicted
+"""
+
+import os
+import sys
+
+# Fix Windows encoding
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+    os.environ['PYTHONIOENCODING'] = 'utf-8'
+
+import argparse
+import hashlib
+import json
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from config import (
+    DATA_DIR, DOWNLOAD_DIR, TEMP_DIR, OUTPUT_DIR,
+    DOWNLOAD_DIR_BUDGET, TEMP_DIR_BUDGET, OUTPUT_DIR_BUDGET,
+    STORAGE_MIN_AGE, STORAGE_PIN_TTL
+)
+
+INDEX_FILE = DATA_DIR / "storage_index.json"
+PIN_DIR = DATA_DIR / "pins"
+
+# Serializes read-modify-write of the index between threads (service workers)
+INDEX_LOCK = threading.RLock()
+
+
+def log(msg: str, level: str = "INFO"):
+    icons = {"INFO": "[INFO]", "SUCCESS": "[OK]", "ERROR": "[ERROR]", "WARN": "[WARN]", "STEP": "[STEP]"}
+    print(f"{icons.get(level, '')} {msg}")
+
+
+def format_size(size_bytes: int) -> str:
+    if size_bytes < 1024:
+        return f"{size_bytes} B"
+    elif size_bytes < 1024 * 1024:
+        return f"{size_bytes / 1024:.1f} KB"
+    elif size_bytes < 1024 ** 3:
+        return f"{size_bytes / (1024 * 1024):.1f} MB"
+    else:
+        return f"{size_bytes / 1024 ** 3:.2f} GB"
+
+
+def get_budgets() -> dict:
+    """Managed directories and their byte budgets"""
+    return {
+        DOWNLOAD_DIR: DOWNLOAD_DIR_BUDGET,
+        TEMP_DIR: TEMP_DIR_BUDGET,
+        OUTPUT_DIR: OUTPUT_DIR_BUDGET,
+    }
+
+
+def _key(path: Path) -> str:
+    return str(Path(path).resolve())
+
+
+# =============================================================================
+# Last-use index
+# =============================================================================
+
+def load_index() -> dict:
+    try:
+        return json.loads(INDEX_FILE.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def write_json_atomic(path: Path, data, indent: int = None):
+    """Write JSON through a uniquely named temp file so concurrent writers never collide"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=path.parent,
+                                     prefix=f".{path.name}.", suffix=".tmp", delete=False) as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+    os.replace(f.name, path)
+
+
+def save_index(index: dict):
+    write_json_atomic(INDEX_FILE, index, indent=2)
+
+
+def touch(*paths):
+    """Record that artifacts were just used"""
+    with INDEX_LOCK:
+        index = load_index()
+        now = time.time()
+        for path in paths:
+            if path:
+                index[_key(path)] = now
+        save_index(index)
+
+
+# =============================================================================
+# Pins (artifacts used by an in-flight job)
+# =============================================================================
+
+def _process_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        # os.kill(pid, 0) terminates the process on Windows; rely on STORAGE_PIN_TTL
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def pin(path: Path) -> Path:
+    """Protect an artifact from eviction until unpin() is called. Returns the pin file."""
+    PIN_DIR.mkdir(parents=True, exist_ok=True)
+    key = _key(path)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    # Unique per call: threads pinning the same artifact each hold their own pin
+    pin_file = PIN_DIR / f"{os.getpid()}-{uuid.uuid4().hex[:12]}-{digest}.pin"
+    pin_file.write_text(key, encoding='utf-8')
+    return pin_file
+
+
+def unpin(pin_file: Path):
+    try:
+        pin_file.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def live_pins() -> set:
+    """Paths pinned by running processes. Stale pin files are removed."""
+    pins = set()
+    if not PIN_DIR.exists():
+        return pins
+
+    now = time.time()
+    for pin_file in PIN_DIR.glob("*.pin"):
+        try:
+            pid = int(pin_file.name.split('-', 1)[0])
+            age = now - pin_file.stat().st_mtime
+            target = pin_file.read_text(encoding='utf-8').strip()
+        except (OSError, ValueError):
+            continue
+
+        if age > STORAGE_PIN_TTL or not _process_alive(pid):
+            unpin(pin_file)
+            continue
+        pins.add(target)
+
+    return pins
+
+
+def is_pinned(path: Path, pins: set) -> bool:
+    key = _key(path)
+    prefix = key.rstrip(os.sep) + os.sep
+    return any(p == key or p.startswith(prefix) for p in pins)
+
+
+# =============================================================================
+# Scanning and eviction
+# =============================================================================
+
+def artifact_size(path: Path) -> int:
+    if path.is_file():
+        return path.stat().st_size
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += (Path(root) / name).stat().st_size
+            except OSError:
+                pass
+    return total
+
+
+def artifact_mtime(path: Path) -> float:
+    mtime = path.stat().st_mtime
+    if path.is_dir():
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    mtime = max(mtime, (Path(root) / name).stat().st_mtime)
+                except OSError:
+                    pass
+    return mtime
+
+
+def scan(directory: Path, index: dict = None) -> list:
+    """List top-level artifacts in a directory, least recently used first"""
+    if index is None:
+        index = load_index()
+    if not directory.exists():
+        return []
+
+    artifacts = []
+    for path in directory.iterdir():
+        try:
+            mtime = artifact_mtime(path)
+            size = artifact_size(path)
+        except OSError:
+            continue
+        artifacts.append({
+            'path': path,
+            'size': size,
+            'mtime': mtime,
+            'last_used': max(mtime, index.get(_key(path), 0)),
+        })
+
+    artifacts.sort(key=lambda a: a['last_used'])
+    return artifacts
+
+
+def remove_artifact(path: Path):
+    if path.is_dir():
+        shutil.rmtree(path)
+    else:
+        path.unlink()
+
+
+def enforce_budget(directory: Path, budget: int, index: dict, pins: set, dry_run: bool = False) -> list:
+    """Evict LRU artifacts until the directory fits its budget. Returns evicted artifacts."""
+    artifacts = scan(directory, index)
+    used = sum(a['size'] for a in artifacts)
+    evicted = []
+
+    if budget is None or used <= budget:
+        return evicted
+
+    now = time.time()
+    for artifact in artifacts:
+        if used <= budget:
+            break
+        path = artifact['path']
+        if is_pinned(path, pins):
+            continue
+        if now - artifact['mtime'] < STORAGE_MIN_AGE:
+            continue
+
+        if not dry_run:
+            try:
+                remove_artifact(path)
+            except OSError as e:
+                log(f"Cannot evict {path}: {e}", "WARN")
+                continue
+            index.pop(_key(path), None)
+
+        used -= artifact['size']
+        evicted.append(artifact)
+
+    if used > budget:
+        log(f"{directory} still over budget: {format_size(used)} / {format_size(budget)}", "WARN")
+
+    return evicted
+
+
+def collect_garbage(dry_run: bool = False, verbose: bool = True) -> dict:
+    """Enforce every directory budget. Returns {directory: [evicted paths]}."""
+    with INDEX_LOCK:
+        return _collect_garbage(dry_run, verbose)
+
+
+def _collect_garbage(dry_run: bool, verbose: bool) -> dict:
+    index = load_index()
+    pins = live_pins()
+    report = {}
+
+    for directory, budget in get_budgets().items():
+        evicted = enforce_budget(directory, budget, index, pins, dry_run=dry_run)
+        report[str(directory)] = [str(a['path']) for a in evicted]
+        if verbose:
+            for artifact in evicted:
+                action = "Would evict" if dry_run else "Evicted"
+                log(f"{action}: {artifact['path']} ({format_size(artifact['size'])})", "INFO")
+
+    if not dry_run:
+        known = {_key(d) for d in get_budgets()}
+        index = {k: v for k, v in index.items()
+                 if Path(k).exists() or not any(k.startswith(d) for d in known)}
+        save_index(index)
+
+    return report
+
+
+def show_status():
+    index = load_index()
+    pins = live_pins()
+
+    print("\n" + "=" * 60)
+    print("Storage Usage")
+    print("=" * 60)
+
+    for directory, budget in get_budgets().items():
+        artifacts = scan(directory, index)
+        used = sum(a['size'] for a in artifacts)
+        limit = format_size(budget) if budget is not None else "unlimited"
+        in_use = sum(1 for a in artifacts if is_pinned(a['path'], pins))
+        print(f"\n  {directory}")
+        print(f"      {format_size(used)} / {limit} | {len(artifacts)} items | {in_use} in use")
+
+    print("\n" + "=" * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BookToNotes storage manager')
+    parser.add_argument('action', choices=['status', 'gc'],
+                       help='Action to perform')
+    parser.add_argument('--dry-run', action='store_true',
+                       help='Only report what gc would evict')
+    args = parser.parse_args()
+
+    if args.action == 'status':
+        show_status()
+    elif args.action == 'gc':
+        log("Enforcing storage budgets...", "STEP")
+        report = collect_garbage(dry_run=args.dry_run)
+        count = sum(len(v) for v in report.values())
+        log(f"{'Would evict' if args.dry_run else 'Evicted'} {count} items", "SUCCESS")
+
+
+if __name__ == "__main__":
+    main()
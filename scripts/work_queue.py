@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+BookToNotes - Distributed Work Queue
+Several worker hosts prepare books from one shared SQLite queue. Jobs are
+claimed with a lease that the worker renews by heartbeat; leases that expire
+(worker crashed or lost its connection) are re-queued automatically.
+
+Each claim bumps a lease token. A worker can only complete or fail a job
+while it still holds the current token, so a job that was re-queued and
+picked up elsewhere is never recorded twice.
+
+The notebook created by an upload is stored in the job row as soon as the
+upload finishes. A worker that re-claims the job (the first one crashed
+before completing it) reuses that notebook instead of uploading again.
+
+Usage:
+  python work_queue.py add "Book Title" "Another Title"   # Enqueue titles
+  python work_queue.py add --list reading_list.txt        # One title per line
+  python work_queue.py worker                             # Run a worker on this host
+  python work_queue.py status                             # Show queue state
+  python work_queue.py retry                              # Re-queue failed jobs
+"""
+
+import os
+import sys
+
+# Fix Windows encoding
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+    os.environ['PYTHONIOENCODING'] = 'utf-8'
+
+import argparse
+import json
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+from pathlib import Path
+
+from config import (
+    WORK_QUEUE_DB, WORK_LEASE_SECONDS, WORK_HEARTBEAT_INTERVAL,
+    WORK_MAX_ATTEMPTS, WORK_POLL_INTERVAL, FINGERPRINT_REUSE_UNATTENDED
+)
+
+
+def log(msg: str, level: str = "INFO"):
+    icons = {"INFO": "[INFO]", "SUCCESS": "[OK]", "ERROR": "[ERROR]", "WARN": "[WARN]", "STEP": "[STEP]"}
+    print(f"{icons.get(level, '')} {msg}")
+
+
+class WorkQueue:
+    """Lease-based job queue in a SQLite file on shared storage"""
+
+    def __init__(self, db_path: Path = WORK_QUEUE_DB):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    params TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    lease_owner TEXT,
+                    lease_expires REAL,
+                    lease_token INTEGER NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    uploaded TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "uploaded" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN uploaded TEXT")
+
+    def _connect(self):
+        # Rollback journal (not WAL): WAL needs shared memory, which network filesystems lack
+        conn = sqlite3.connect(str(self.db_path), timeout=60, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        return conn
+
+    def _transaction(self, func):
+        """Run func(conn) inside BEGIN IMMEDIATE so only one node mutates at a time"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            result = func(conn)
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def add(self, params: dict) -> str:
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, params, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, json.dumps(params, ensure_ascii=False), now, now)
+            )
+        return job_id
+
+    @staticmethod
+    def _expire_leases(conn, now: float) -> int:
+        """Return expired leases to the queue, or fail jobs out of attempts"""
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', error = 'lease expired too often', lease_owner = NULL, "
+            "updated_at = ? WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+            (now, now, WORK_MAX_ATTEMPTS)
+        )
+        cur = conn.execute(
+            "UPDATE jobs SET status = 'queued', lease_owner = NULL, updated_at = ? "
+            "WHERE status = 'leased' AND lease_expires < ?",
+            (now, now)
+        )
+        return cur.rowcount
+
+    def claim(self, worker_id: str):
+        """Lease the oldest queued job. Returns (id, token, params) or None."""
+        def do_claim(conn):
+            now = time.time()
+            expired = self._expire_leases(conn, now)
+            if expired:
+                log(f"Re-queued {expired} jobs with expired leases", "WARN")
+
+            row = conn.execute(
+                "SELECT id, params, lease_token FROM jobs WHERE status = 'queued' "
+                "ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if not row:
+                return None
+
+            token = row[2] + 1
+            conn.execute(
+                "UPDATE jobs SET status = 'leased', lease_owner = ?, lease_expires = ?, "
+                "lease_token = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (worker_id, now + WORK_LEASE_SECONDS, token, now, row[0])
+            )
+            return row[0], token, json.loads(row[1])
+
+        return self._transaction(do_claim)
+
+    def heartbeat(self, job_id: str, token: int) -> bool:
+        """Extend a lease. False means the lease was lost."""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? "
+                "WHERE id = ? AND lease_token = ? AND status = 'leased'",
+                (now + WORK_LEASE_SECONDS, now, job_id, token)
+            )
+            return cur.rowcount == 1
+
+    def record_upload(self, job_id: str, upload: dict):
+        """
+        Remember the notebook a job uploaded to. Not fenced by the lease token:
+        the notebook exists whoever holds the lease, and the next holder must reuse it.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET uploaded = ?, updated_at = ? WHERE id = ? AND status != 'done'",
+                (json.dumps(upload, ensure_ascii=False), time.time(), job_id)
+            )
+
+    def recorded_upload(self, job_id: str):
+        """The upload stored by record_upload, or None"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT uploaded FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def complete(self, job_id: str, token: int, result: dict) -> bool:
+        """Record a result. Ignored (returns False) if the lease is no longer held."""
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, lease_owner = NULL, updated_at = ? "
+                "WHERE id = ? AND lease_token = ? AND status = 'leased'",
+                (json.dumps(result, ensure_ascii=False), time.time(), job_id, token)
+            )
+            return cur.rowcount == 1
+
+    def fail(self, job_id: str, token: int, error: str) -> bool:
+        """Re-queue a failed job, or mark it failed once it is out of attempts"""
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+                "error = ?, lease_owner = NULL, updated_at = ? "
+                "WHERE id = ? AND lease_token = ? AND status = 'leased'",
+                (WORK_MAX_ATTEMPTS, error, time.time(), job_id, token)
+            )
+            return cur.rowcount == 1
+
+    def retry_failed(self) -> int:
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'queued', attempts = 0, error = NULL, updated_at = ? "
+                "WHERE status = 'failed'",
+                (time.time(),)
+            )
+            return cur.rowcount
+
+    def jobs(self) -> list:
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute("SELECT * FROM jobs ORDER BY created_at").fetchall()
+        return [dict(r) for r in rows]
+
+
+# =============================================================================
+# Worker
+# =============================================================================
+
+class Heartbeat:
+    """Background thread that keeps a lease alive while a job runs"""
+
+    def __init__(self, queue: WorkQueue, job_id: str, token: int):
+        self.queue = queue
+        self.job_id = job_id
+        self.token = token
+        self.lost = False
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stopping.wait(WORK_HEARTBEAT_INTERVAL):
+            try:
+                if not self.queue.heartbeat(self.job_id, self.token):
+                    log(f"Lease on job {self.job_id} lost", "WARN")
+                    self.lost = True
+                    return
+            except sqlite3.Error as e:
+                log(f"Heartbeat failed: {e}", "WARN")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopping.set()
+        self.thread.join()
+
+
+def lease_bound_upload(queue: WorkQueue, job_id: str, heartbeat: Heartbeat):
+    """
+    Upload callable for prepare_book. Reuses a notebook recorded by an earlier
+    attempt, refuses to start once the lease is lost, and records the notebook
+    in the shared queue before the job is completed.
+    """
+    from journal import StageAborted
+    from prepare import upload_to_notebooklm
+
+    def upload(pdf_file: Path, book_name: str) -> tuple:
+        recorded = queue.recorded_upload(job_id)
+        if recorded:
+            log(f"Job {job_id} already uploaded as {recorded['notebook_id']}, reusing it", "INFO")
+            return recorded['notebook_id'], recorded.get('notebook_url')
+        if heartbeat.lost:
+            raise StageAborted(f"lease on job {job_id} lost, not uploading")
+
+        notebook_id, notebook_url = upload_to_notebooklm(pdf_file, book_name)
+        if notebook_id:
+            queue.record_upload(job_id, {"notebook_id": notebook_id, "notebook_url": notebook_url,
+                                         "book_name": book_name})
+        return notebook_id, notebook_url
+
+    return upload
+
+
+def run_worker(worker_id: str, once: bool = False) -> bool:
+    """Claim and prepare jobs until interrupted. Returns False if this host cannot work."""
+    from journal import StageFailed
+    from prepare import prepare_book
+    from service import WarmZlibClient
+
+    queue = WorkQueue()
+    zlib = WarmZlibClient()
+    if not zlib.start():
+        # Every queued job is a Zlib query; claiming them would only burn their attempts
+        log("Telegram client unavailable; not claiming jobs on this host", "ERROR")
+        zlib.stop()
+        return False
+    log(f"Worker {worker_id} polling {queue.db_path}", "SUCCESS")
+
+    try:
+        while True:
+            job = queue.claim(worker_id)
+            if not job:
+                if once:
+                    return True
+                time.sleep(WORK_POLL_INTERVAL)
+                continue
+
+            job_id, token, params = job
+            log(f"Job {job_id} claimed: {params}", "STEP")
+
+            with Heartbeat(queue, job_id, token) as heartbeat:
+                try:
+                    result = prepare_book(
+                        query=params.get("query"),
+                        file_path=params.get("file"),
+                        book_name=params.get("name"),
+                        fetch=zlib.fetch,
+                        reuse=FINGERPRINT_REUSE_UNATTENDED,
+                        upload=lease_bound_upload(queue, job_id, heartbeat)
+                    )
+                    error = None
+                except StageFailed as e:
+                    result, error = None, str(e)
+                except Exception as e:
+                    result, error = None, f"crashed: {type(e).__name__}: {e}"
+
+            if heartbeat.lost:
+                log(f"Job {job_id} was re-queued elsewhere; discarding outcome", "WARN")
+            elif result:
+                if queue.complete(job_id, token, dict(result, worker=worker_id)):
+                    log(f"Job {job_id} done", "SUCCESS")
+                else:
+                    log(f"Job {job_id} lease expired before completion; result discarded", "WARN")
+            else:
+                queue.fail(job_id, token, error)
+                log(f"Job {job_id} failed: {error}", "ERROR")
+
+    except KeyboardInterrupt:
+        log("Worker stopping (leased job will be re-queued when its lease expires)", "INFO")
+        return True
+    finally:
+        zlib.stop()
+
+
+def show_status(queue: WorkQueue):
+    jobs = queue.jobs()
+    counts = {}
+    for job in jobs:
+        counts[job['status']] = counts.get(job['status'], 0) + 1
+
+    print("\n" + "=" * 70)
+    print(f"Work Queue: {queue.db_path}")
+    print("  " + " | ".join(f"{k}: {v}" for k, v in sorted(counts.items())) if counts else "  empty")
+    print("=" * 70)
+
+    now = time.time()
+    for job in jobs:
+        params = json.loads(job['params'])
+        label = params.get('query') or params.get('file')
+        line = f"\n  [{job['status']}] {label}  (id {job['id']}, attempts {job['attempts']})"
+        if job['status'] == 'leased':
+            line += f"\n      worker {job['lease_owner']}, lease {job['lease_expires'] - now:.0f}s left"
+        elif job['status'] == 'failed' and job['error']:
+            line += f"\n      {job['error']}"
+        print(line)
+
+    print("\n" + "=" * 70)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distributed BookToNotes work queue')
+    parser.add_argument('action', choices=['add', 'worker', 'status', 'retry'],
+                       help='Action to perform')
+    parser.add_argument('titles', nargs='*', help='Book titles to enqueue (for add)')
+    parser.add_argument('--list', '-l', help='Reading list file, one title per line (for add)')
+    parser.add_argument('--id', default=None,
+                       help='Worker id (default: hostname-pid)')
+    parser.add_argument('--once', action='store_true',
+                       help='Exit when the queue is empty instead of polling')
+    args = parser.parse_args()
+
+    if args.action == 'add':
+        titles = list(args.titles)
+        if args.list:
+            with open(args.list, 'r', encoding='utf-8') as f:
+                titles += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        if not titles:
+            parser.error("add needs titles or --list")
+        queue = WorkQueue()
+        for title in titles:
+            queue.add({"query": title})
+        log(f"Enqueued {len(titles)} books", "SUCCESS")
+
+    elif args.action == 'worker':
+        if not run_worker(args.id or f"{socket.gethostname()}-{os.getpid()}", once=args.once):
+            sys.exit(1)
+
+    elif args.action == 'status':
+        show_status(WorkQueue())
+
+    elif args.action == 'retry':
+        log(f"Re-queued {WorkQueue().retry_failed()} failed jobs", "SUCCESS")
+
+
+if __name__ == "__main__":
+    main()
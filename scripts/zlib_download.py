@@ -16,20 +16,38 @@ import asyncio
 import argparse
 import re
 import json
+import time
+from collections import deque
 from pathlib import Path
 
 try:
     from telethon import TelegramClient
     from telethon.tl.types import DocumentAttributeFilename
+    from telethon.utils import get_appropriated_part_size
 except ImportError:
     print("[ERROR] Telethon not installed. Run: pip install telethon")
     sys.exit(1)
 
 from config import (
-    TELEGRAM_API_ID, TELEGRAM_API_HASH, ZLIB_BOT_USERNAME,
-    SESSION_DIR, DOWNLOAD_DIR,
-    DOWNLOAD_TIMEOUT, SEARCH_TIMEOUT, MAX_SEARCH_RESULTS
+    TELEGRAM_API_ID, TELEGRAM_API_HASH, ZLIB_BOT_USERNAMES,
+    SESSION_DIR, DOWNLOAD_DIR, SEARCH_TIMEOUT, MAX_SEARCH_RESULTS,
+    DOWNLOAD_REPLY_TIMEOUT, DOWNLOAD_STALL_TIMEOUT, DOWNLOAD_MIN_THROUGHPUT,
+    DOWNLOAD_THROUGHPUT_WINDOW, DOWNLOAD_PROGRESS_INTERVAL, DOWNLOAD_MAX_CANDIDATES
 )
+from bot_stats import BotStats
+from integrity import IntegrityError, ValidatingWriter, validate_file
+
+SEARCH_POLL_INTERVAL = 1  # seconds between checks for a bot reply
+SEARCH_SETTLE_TIME = 5  # seconds to wait for results after a non-result reply
+
+# Human-readable descriptions of ZlibDownloader.last_error
+FAILURE_REASONS = {
+    "not found": "no search results",
+    "timeout": "bot did not send the file in time",
+    "stalled": "transfer stalled",
+    "integrity": "downloaded file was corrupt",
+    "transfer": "transfer failed",
+}
 
 
 def log(msg: str, level: str = "INFO"):
@@ -57,6 +75,93 @@ def format_size(size_bytes: int) -> str:
         return f"{size_bytes / (1024 * 1024):.1f} MB"
 
 
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    return f"{seconds // 60}m{seconds % 60:02d}s"
+
+
+def download_part_size(file_size: int) -> int:
+    """Bytes Telethon fetches per request; progress is only reported once per part"""
+    return get_appropriated_part_size(file_size) * 1024 if file_size else 512 * 1024
+
+
+class TransferMonitor:
+    """Tracks download progress and decides when a transfer has stalled"""
+
+    def __init__(self, total: int = 0):
+        self.total = total
+        self.stall_timeout = self._stall_timeout(total)
+        self.received = 0
+        self.start = time.monotonic()
+        self.last_progress = self.start
+        self.samples = deque([(self.start, 0)])
+
+    def update(self, current: int, total: int):
+        """Telethon progress_callback"""
+        now = time.monotonic()
+        if total and total != self.total:
+            self.total = total
+            self.stall_timeout = self._stall_timeout(total)
+        if current > self.received:
+            self.received = current
+            self.last_progress = now
+            self.samples.append((now, current))
+            while len(self.samples) > 2 and now - self.samples[1][0] > DOWNLOAD_THROUGHPUT_WINDOW:
+                self.samples.popleft()
+
+    @staticmethod
+    def _stall_timeout(total: int) -> float:
+        # A transfer running at DOWNLOAD_MIN_THROUGHPUT reports one part every
+        # part_size / throughput seconds; waiting less would abort healthy transfers
+        return max(DOWNLOAD_STALL_TIMEOUT, download_part_size(total) / DOWNLOAD_MIN_THROUGHPUT)
+
+    def rate(self) -> float:
+        """Bytes/sec over the recent window"""
+        now = time.monotonic()
+        t0, b0 = self.samples[0]
+        elapsed = now - t0
+        return (self.received - b0) / elapsed if elapsed > 0 else 0.0
+
+    def sustained_rate(self) -> float:
+        """
+        Bytes/sec between progress reports in the recent window. Progress comes
+        in whole parts, so the idle time since the last report is left to the
+        stall timeout instead of being counted as zero throughput.
+        """
+        t0, b0 = self.samples[0]
+        elapsed = self.last_progress - t0
+        return (self.received - b0) / elapsed if elapsed > 0 else 0.0
+
+    def eta(self) -> float:
+        rate = self.rate()
+        if not self.total or rate <= 0:
+            return None
+        return max(self.total - self.received, 0) / rate
+
+    def stall_reason(self) -> str:
+        """Why the transfer should be aborted, or None while it is healthy"""
+        now = time.monotonic()
+        idle = now - self.last_progress
+        if idle > self.stall_timeout:
+            return f"no progress for {idle:.0f}s"
+        rate = self.sustained_rate()
+        if self.last_progress - self.start > DOWNLOAD_THROUGHPUT_WINDOW and rate < DOWNLOAD_MIN_THROUGHPUT:
+            return f"throughput {format_size(int(rate))}/s below {format_size(DOWNLOAD_MIN_THROUGHPUT)}/s"
+        return None
+
+    def describe(self) -> str:
+        text = f"{format_size(self.received)}"
+        if self.total:
+            text += f" / {format_size(self.total)} ({self.received * 100 // self.total}%)"
+        text += f" at {format_size(int(self.rate()))}/s"
+        eta = self.eta()
+        if eta is not None:
+            text += f", ETA {format_duration(eta)}"
+        return text
+
+
 def parse_search_results(msg) -> list:
     """Parse search results from bot message"""
     results = []
@@ -113,8 +218,12 @@ class ZlibDownloader:
     def __init__(self):
         self.client = None
         self.bot_entity = None
+        self.bot_entities = {}
+        self.stats = BotStats()
         self.search_results = []
         self.downloaded_file = None
+        self.downloaded_sha256 = None
+        self.last_error = None
 
     async def connect(self):
         if not TELEGRAM_API_ID or not TELEGRAM_API_HASH:
@@ -129,38 +238,100 @@ class ZlibDownloader:
             log("Not authenticated. Run: python tg_auth.py setup", "ERROR")
             return False
 
-        try:
-            self.bot_entity = await self.client.get_entity(ZLIB_BOT_USERNAME)
-            log(f"Connected to @{ZLIB_BOT_USERNAME}", "SUCCESS")
-            return True
-        except Exception as e:
-            log(f"Cannot find bot: {e}", "ERROR")
+        for username in ZLIB_BOT_USERNAMES:
+            try:
+                self.bot_entities[username] = await self.client.get_entity(username)
+                log(f"Connected to @{username}", "SUCCESS")
+            except Exception as e:
+                log(f"Cannot find bot @{username}: {e}", "WARN")
+
+        if not self.bot_entities:
+            log("No usable bot configured", "ERROR")
             return False
 
+        self.bot_entity = next(iter(self.bot_entities.values()))
+        return True
+
     async def disconnect(self):
         if self.client:
             await self.client.disconnect()
 
+    async def _search_bot(self, username: str, query: str) -> list:
+        """Send a search to one bot and poll for its result list"""
+        entity = self.bot_entities[username]
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        first_reply_at = None
+
+        try:
+            sent = await self.client.send_message(entity, query)
+
+            while loop.time() - start < SEARCH_TIMEOUT:
+                await asyncio.sleep(SEARCH_POLL_INTERVAL)
+
+                messages = await self.client.get_messages(entity, limit=5, min_id=sent.id)
+                for msg in messages:
+                    if msg.out:
+                        continue
+                    if first_reply_at is None:
+                        first_reply_at = loop.time()
+                    if msg.text and '📚' in msg.text:
+                        results = parse_search_results(msg)
+                        if results:
+                            self.stats.record(username, loop.time() - start, True)
+                            for r in results:
+                                r['bot'] = username
+                            return results
+
+                # The bot answered without a result list (e.g. nothing found)
+                if first_reply_at and loop.time() - first_reply_at > SEARCH_SETTLE_TIME:
+                    self.stats.record(username, first_reply_at - start, True)
+                    return []
+
+        except asyncio.CancelledError:
+            # Lost the hedge race: the elapsed time is a lower bound on this bot's
+            # latency. Dropping it would leave only the fast samples in the stats.
+            self.stats.record_censored(username, loop.time() - start)
+            raise
+        except Exception as e:
+            log(f"Search on @{username} failed: {e}", "WARN")
+
+        self.stats.record(username, None, False)
+        return []
+
     async def search_book(self, query: str) -> list:
-        """Search for books"""
+        """Search for books, hedging to a second bot when the first one is slow"""
         log(f"Searching: {query}", "STEP")
         self.search_results = []
 
-        await self.client.send_message(self.bot_entity, query)
-        await asyncio.sleep(5)
-
-        messages = await self.client.get_messages(self.bot_entity, limit=5)
-
-        for msg in messages:
-            if msg.out:
-                continue
-            if msg.text and '📚' in msg.text:
-                results = parse_search_results(msg)
-                if results:
-                    self.search_results = results
+        bots = self.stats.rank(list(self.bot_entities))
+        primary = asyncio.ensure_future(self._search_bot(bots[0], query))
+        pending = {primary}
+
+        if len(bots) > 1:
+            delay = self.stats.hedge_delay(bots[0])
+            await asyncio.wait(pending, timeout=delay)
+            if not primary.done() or not primary.result():
+                log(f"@{bots[0]} slow or empty after {delay:.1f}s, hedging to @{bots[1]}", "INFO")
+                pending.add(asyncio.ensure_future(self._search_bot(bots[1], query)))
+
+        # First usable result set wins; the other request is cancelled
+        while pending and not self.search_results:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.result():
+                    self.search_results = task.result()
                     break
 
-        log(f"Found {len(self.search_results)} books", "INFO")
+        for task in pending:
+            task.cancel()
+        # Let cancelled searches record their censored samples before returning
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        if self.search_results:
+            log(f"Found {len(self.search_results)} books via @{self.search_results[0]['bot']}", "INFO")
+        else:
+            log("Found 0 books", "INFO")
         return self.search_results
 
     def display_results(self):
@@ -182,7 +353,8 @@ class ZlibDownloader:
         print("\n" + "=" * 70)
 
     async def download_book(self, index: int = 0, custom_filename: str = None) -> Path:
-        """Download book by sending /book command"""
+        """Download book by sending /book command. On failure, last_error says why."""
+        self.last_error = None
         if not self.search_results:
             log("No search results", "ERROR")
             return None
@@ -196,13 +368,16 @@ class ZlibDownloader:
 
         DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-        await self.client.send_message(self.bot_entity, book['command'])
+        # Download commands only work on the bot that produced the result
+        bot_entity = self.bot_entities.get(book.get('bot'), self.bot_entity)
+        sent = await self.client.send_message(bot_entity, book['command'])
 
+        # Phase 1: wait for the bot to reply with the file
         start_time = asyncio.get_event_loop().time()
-        while asyncio.get_event_loop().time() - start_time < DOWNLOAD_TIMEOUT:
+        while asyncio.get_event_loop().time() - start_time < DOWNLOAD_REPLY_TIMEOUT:
             await asyncio.sleep(3)
 
-            messages = await self.client.get_messages(self.bot_entity, limit=5)
+            messages = await self.client.get_messages(bot_entity, limit=5, min_id=sent.id)
 
             for msg in messages:
                 if msg.out:
@@ -230,24 +405,99 @@ class ZlibDownloader:
                         filepath = DOWNLOAD_DIR / filename
 
                         log(f"Receiving file: {filename} ({format_size(file_size)})", "INFO")
-                        await self.client.download_media(msg, file=str(filepath))
 
-                        if filepath.exists():
-                            actual_size = filepath.stat().st_size
-                            log(f"Downloaded: {filepath}", "SUCCESS")
-                            log(f"Size: {format_size(actual_size)}", "INFO")
-                            self.downloaded_file = filepath
-                            return filepath
+                        # Phase 2: transfer, bounded by stalls rather than total time
+                        if not await self._transfer(msg, filepath, file_size):
+                            return None
+
+                        actual_size = filepath.stat().st_size
+                        log(f"Downloaded: {filepath}", "SUCCESS")
+                        log(f"Size: {format_size(actual_size)}", "INFO")
+                        log(f"SHA-256: {self.downloaded_sha256}", "INFO")
+                        self.downloaded_file = filepath
+                        return filepath
 
-        log("Download timeout", "ERROR")
+        log(f"No file from bot within {DOWNLOAD_REPLY_TIMEOUT}s", "ERROR")
+        self.last_error = "timeout"
         return None
 
+    async def _transfer(self, msg, filepath: Path, file_size: int) -> bool:
+        """
+        Download a message's document, aborting when progress stalls.
+        The stream is hashed and format-checked as it arrives, then validated
+        as a whole before it is renamed into place.
+        """
+        partial = filepath.with_name(filepath.name + ".part")
+        monitor = TransferMonitor(file_size)
+        writer = ValidatingWriter(partial, filepath.suffix)
+
+        task = asyncio.ensure_future(
+            self.client.download_media(msg, file=writer, progress_callback=monitor.update)
+        )
+
+        last_report = time.monotonic()
+        reason = None
+        while not task.done():
+            await asyncio.wait({task}, timeout=1)
+            if task.done():
+                break
+
+            reason = monitor.stall_reason()
+            if reason:
+                task.cancel()
+                break
+
+            if time.monotonic() - last_report >= DOWNLOAD_PROGRESS_INTERVAL:
+                log(f"Progress: {monitor.describe()}", "INFO")
+                last_report = time.monotonic()
+
+        try:
+            await task
+        except asyncio.CancelledError:
+            if not reason:
+                writer.close()
+                partial.unlink()
+                raise
+            self.last_error = "stalled"
+        except IntegrityError as e:
+            reason = str(e)
+            self.last_error = "integrity"
+        except Exception as e:
+            reason = str(e)
+            self.last_error = "transfer"
+        finally:
+            writer.close()
+
+        if not reason:
+            try:
+                validate_file(partial, expected_size=file_size, suffix=filepath.suffix)
+            except IntegrityError as e:
+                reason = str(e)
+                self.last_error = "integrity"
+
+        if reason:
+            log(f"Transfer aborted: {reason}", "ERROR")
+            try:
+                partial.unlink()
+            except FileNotFoundError:
+                pass
+            return False
+
+        self.downloaded_sha256 = writer.hexdigest()
+        os.replace(partial, filepath)
+        return True
+
+    def failure_reason(self) -> str:
+        return FAILURE_REASONS.get(self.last_error, self.last_error or "download failed")
+
     async def search_and_download(self, query: str, auto_select: bool = True, select_index: int = None) -> Path:
-        """Search and download in one step"""
+        """Search and download in one step. On failure, last_error says why."""
+        self.last_error = None
         results = await self.search_book(query)
 
         if not results:
             log("No books found", "ERROR")
+            self.last_error = "not found"
             return None
 
         self.display_results()
@@ -263,7 +513,16 @@ class ZlibDownloader:
             except (ValueError, EOFError):
                 index = 0
 
-        return await self.download_book(index)
+        # Broken files fall through to the next-ranked candidate
+        candidates = [index] + [i for i in range(len(results)) if i != index]
+        for attempt, candidate in enumerate(candidates[:DOWNLOAD_MAX_CANDIDATES]):
+            if attempt:
+                log(f"Trying next candidate: {results[candidate]['title']}", "INFO")
+            filepath = await self.download_book(candidate)
+            if filepath or self.last_error != "integrity":
+                return filepath
+
+        return None
 
 
 async def main_async(args):
@@ -283,7 +542,8 @@ async def main_async(args):
             result = {
                 "success": True,
                 "file": str(filepath),
-                "size": filepath.stat().st_size
+                "size": filepath.stat().st_size,
+                "sha256": downloader.downloaded_sha256
             }
             print("\n--- RESULT JSON ---")
             print(json.dumps(result, ensure_ascii=False, indent=2))